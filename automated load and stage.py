@@ -1,434 +1,2276 @@
-"""Automated data loading and staging - Pedestrian counting system.
-
-This project demonstrates an end-to-end data science project from data engineering
-(including automated data loading, wrangling, and staging) to visual analytics (interactive visualisation dashboards).
-The datasets (Pedestrian Counting System) include locations of pedestrian sensor devices across Melbourne city
-and hourly pedestrian counts from these sensors.
-
-Author: Hoang Tam Vo
-
-Version: 1.0
-"""
-
-# Import required libraries
-import sqlite3 as sqldb  # light-weight sql database engine for demos
-import pandas as pd  # data analysis and manipulation tool
-from pandas_profiling import ProfileReport  # create profiling report for a dataframe
-
-####################################################################################
-## Define constant variables and configurations for the entire project
-####################################################################################
-
-# Location of staging database
-SQLITE_DB_FILE_NAME = "./staged_pedestrian.db"
-staged_db = sqldb.connect(SQLITE_DB_FILE_NAME)  # connect to staging database
-
-# Data sources API endpoints
-URL_SENSOR_LOCATION = "https://data.melbourne.vic.gov.au/resource/h57g-5234.csv"
-URL_PEDESTRIAN_PER_HOUR = "https://data.melbourne.vic.gov.au/resource/b2ak-trbp.csv"
-
-# Melbourne 6 lockdown periods: https://www.platinumaccounting.com.au/melbourne-lockdown-dates/
-LOCKDOWN_PERIODS = [('20200331', '20200512'), ('20200709', '20201027'), ('20210213', '20210217')
-    , ('20210528', '20211006'), ('20210716', '20210727'), ('20210805', '20211021')]
-
-
-####################################################################################
-## Utility functions for accessing staged databases
-####################################################################################
-
-def stage_df_as_table(df, db_connection, table_name, if_exists="fail"):
-    """Stages a dataframe.
-
-    Stores a dataframe as a table in the staging database.
-
-    Args:
-        df:
-            A dataframe to be stored into database.
-        db_connection:
-            Connection to the sql database
-        if_exists: {"fail", "replace", "append"}, default "fail"
-            How to behave if the table already exists.
-            fail: Raise a ValueError.
-            replace: Drop the table before inserting new values.
-            append: Insert new values to the existing table.
-    """
-    df.to_sql(table_name, db_connection, if_exists=if_exists)
-
-
-def query_database(db_connection, sql_query):
-    """Fetches data from database.
-
-    Retrieves data from the database with a provided SQL query.
-
-    Args:
-        db_connection:
-            Connection to the sql database
-        sql_query:
-            SQL syntax to retrieve data from the database
-
-    Returns:
-        A dataframe resulted from the execution of the query in the database.
-    """
-    df = pd.read_sql(sql_query, db_connection)
-    return df
-
-
-####################################################################################
-## Data loading, profiling, cleansing, enhancing
-####################################################################################
-
-def load_data(url):
-    """Load data from API endpoint.
-
-    Retrieves data from data sources with the provided API endpoint.
-
-    Args:
-        url:
-            API endpoint
-
-    Returns:
-        A dataframe retrieved from the data source.
-    """
-    limit = 50000  # page size (number of records) to load for each request
-    i = 0
-    df = pd.DataFrame()
-    while True:
-        offset = i * limit
-        endpoint = "{}?$limit={}&$offset={}".format(url, limit, offset)  # load a page from an offset
-        page = pd.read_csv(endpoint)
-        df = pd.concat([df, page])
-        print(endpoint)
-        i += 1
-        if page.shape[0] < 50000:  # this is last page of the whole table
-            break
-    return df
-
-
-def data_profiling(df, report_html_filename):
-    """Profiles data of a dataframe
-
-    Creates a data profiling report of a dataframe and write the report to an html file.
-    """
-    profile = ProfileReport(df)
-    profile.to_file(report_html_filename)
-
-
-def wrangle_sensor_location():
-    """Wrangles sensor location dataset.
-
-    Performs wrangling and cleansing sensor location dataset.
-    """
-    global df_sensor_location
-    # remove special characters \n in front of the location string
-    df_sensor_location["location"] = df_sensor_location["location"].str[5:]
-
-
-def weekday_or_weekend(row):
-    """Returns weekday or weekend value.
-
-    Checks and returns whether it is weekday or weekend, given the row containing a "day" column.
-    """
-    if "Saturday" in row["day"] or "Sunday" in row["day"]:
-        day_type = "Weekend"
-    else:
-        day_type = "Weekday"
-    return day_type
-
-
-def enhance_hourly_counts_data():
-    """Enhances pedestrian hourly counts dataset.
-
-    Performs wrangling, cleasing, and enhancing pedestrian hourly count dataset.
-    Creates a date_key column, which is string following 'yyyymmdd' format.
-    Creates a day_type column, whose value could be weekday or weekend depending on the day in the week.
-    """
-    global df_pedestrian_per_hour
-    # derive date_key from existing date_time column
-    df_pedestrian_per_hour["date_key"] = df_pedestrian_per_hour["date_time"].str[0:10]
-    df_pedestrian_per_hour["date_key"] = df_pedestrian_per_hour["date_key"].str.replace("-", "")
-
-    # create day_type flag as weekday or weekend
-    df_pedestrian_per_hour['day_type'] = df_pedestrian_per_hour.apply(weekday_or_weekend, axis=1)
-
-
-####################################################################################
-## Extract statistics
-####################################################################################
-
-#### Stats 1 and 2: Top N (most pedestrians) locations by Day or Month
-
-def calculate_stats_top_n(time_period):
-    """Calculates top N locations (most pedestrians) by a time period (day or month).
-
-    Steps:
-    - Calculate average hourly counts by (1) time period (day or month) and (2) sensor id
-    - Join with sensor location data to get location info
-    - Calculate the rank within each time period group based on average hourly counts
-    (rank 1 the most pedestrians)
-
-    Args:
-        time_period:
-            "day" or "month" the required period for statistics
-
-    Returns:
-       Dataframe containing the calculated results (ranks of locations by time period)
-    """
-    # template sql query to perform the above steps
-    sql_query = '''select count_stats.*
-        , sensor.sensor_description, sensor.latitude, sensor.longitude, sensor.location 
-    from 
-        ( select {}, sensor_id, AVG(hourly_counts) as avg_hourly_counts
-        from PEDESTRIAN_PER_HOUR
-        group by {}, sensor_id
-        ) count_stats
-    join SENSOR on count_stats.sensor_id = sensor.sensor_id
-    order by {}, avg_hourly_counts DESC'''.format(time_period, time_period, time_period)
-
-    df_top_n_locations = query_database(staged_db, sql_query)
-
-    # calculate rank using pandas (it could have been done in SQL, but current python/sqlite version not possible)
-    df_top_n_locations["rank"] = df_top_n_locations.groupby(time_period)["avg_hourly_counts"].rank("dense",
-                                                                                                   ascending=False)
-    df_top_n_locations["rank"] = df_top_n_locations["rank"].astype("int")
-
-    return df_top_n_locations
-
-
-#### Stats 3: Location has shown most decline due to lockdowns
-
-def calculate_avg_hourly_counts(filter_condition):
-    """Calculates average hourly counts of locations subject to filter condition on data.
-
-    Steps:
-    - Calculate average hourly counts by sensor id on data that has been applied filter condition
-    - Join with sensor location data to get location info
-
-    Args:
-        filter_condition:
-            Condition to filter data for the analysis
-            (e.g, based on date_key to determine precovid, lockdown, or after lockdown periods)
-
-    Returns:
-       Dataframe containing the calculated results (average hourly counts of locations)
-    """
-    # template sql query to perform the above steps
-    sql_query = '''select count_stats.*
-        , sensor.sensor_description, sensor.latitude, sensor.longitude, sensor.location 
-    from 
-        ( select sensor_id, AVG(hourly_counts) as avg_hourly_counts
-        from PEDESTRIAN_PER_HOUR
-        {}
-        group by sensor_id
-        ) count_stats
-    join SENSOR on count_stats.sensor_id = sensor.sensor_id
-    order by sensor_id'''.format(filter_condition)
-
-    df_avg_hourly_counts = query_database(staged_db, sql_query)
-
-    return df_avg_hourly_counts
-
-
-def get_difference_in_hourly_counts(df1, rename_column1, df2, rename_column2, calculated_column, percent_column):
-    """Calculates the difference in average hourly counts (e.g., between precovid and lockdown periods) for each location.
-
-    Inputs: df1 and df2 contain data (e.g., average hourly counts for locations during precovid and lockdown periods)
-    to calculate the difference
-
-    Steps:
-        - step 1: join the two dafaframe based on the location (sensor id)
-        - step 2: calculate the difference in average hourly counts as a new calculated column
-        - step 3: sort the dataframe based on the calculated difference (in descending sort)
-        - step 4: calculate the percent change (decline or growth percent)
-
-    Returns:
-        Dataframe containing the calculated results.
-    """
-    # step 1
-    df1.rename(columns={'avg_hourly_counts': rename_column1}, inplace=True)
-    df2.rename(columns={'avg_hourly_counts': rename_column2}, inplace=True)
-    df = pd.merge(left=df1, right=df2, how="inner")
-
-    # step 2
-    df[calculated_column] = df[rename_column1] - df[rename_column2]
-
-    # step 3
-    df = df.sort_values(calculated_column, ascending=False)
-
-    # step 4
-    if "growth" in percent_column:
-        df[percent_column] = (df[calculated_column] / df[rename_column2]) * 100
-    elif "decline" in percent_column:
-        df[percent_column] = (df[calculated_column] / df[rename_column1]) * 100
-
-    return df
-
-
-def get_locations_most_decline():
-    """Calculates the locations with most declined traffic during lockdowns (compared to precovid).
-
-    Compares the average hourly counts for each location between precovid period and during lockdown period,
-    and returns the location having most decline.
-    """
-    # 6 lockdown periods in Melbourne
-    lockdown_list = [f' (date_key between "{start}" and "{end}") ' for (start, end) in LOCKDOWN_PERIODS]
-
-    # sql filter condition for lockdown periods
-    filter_lockdown_periods = "or".join(lockdown_list)
-
-    # sql filter condition for precovid period
-    filter_precovid_period = " date_key < " + LOCKDOWN_PERIODS[0][0]
-
-    # calculate average hourly counts during lockdown periods
-    df_avg_hourly_counts_lock_down = calculate_avg_hourly_counts(" where " + filter_lockdown_periods)
-
-    # calculate average hourly counts during precovid period
-    df_avg_hourly_counts_pre_covid = calculate_avg_hourly_counts(" where " + filter_precovid_period)
-
-    # calculate the most declined locations
-    df_hourly_counts_decline_lockdown = get_difference_in_hourly_counts(df_avg_hourly_counts_pre_covid,
-                                                                        "precovid_avg_hourly_counts"
-                                                                        , df_avg_hourly_counts_lock_down,
-                                                                        "lockdown_avg_hourly_counts"
-                                                                        , "declined_avg_hourly_counts",
-                                                                        "percent_decline")
-
-    return df_hourly_counts_decline_lockdown
-
-
-#### Stats 4: Location has most growth after lockdowns
-
-def get_locations_most_growth():
-    """Calculates the locations with most growth traffic after lockdowns.
-
-    Compares the average hourly counts for each location between lockdown period and after lockdown,
-    and returns the location having most growth.
-    """
-    # 6 lockdown periods in Melbourne
-    lockdown_list = [f' (date_key between "{start}" and "{end}") ' for (start, end) in LOCKDOWN_PERIODS]
-
-    # sql filter condition for lockdown periods
-    filter_lockdown_periods = "or".join(lockdown_list)
-
-    # sql filter condition for after lockdown period
-    filter_after_lockdown = " date_key > " + LOCKDOWN_PERIODS[-1][1]
-
-    # calculate average hourly counts during lockdown periods
-    df_avg_hourly_counts_lock_down = calculate_avg_hourly_counts(" where " + filter_lockdown_periods)
-
-    # calculate average hourly counts after lockdown period
-    df_avg_hourly_counts_after_lockdown = calculate_avg_hourly_counts(" where " + filter_after_lockdown)
-
-    # calculate the most growth locations
-    df_hourly_counts_growth_after_lockdown = get_difference_in_hourly_counts(df_avg_hourly_counts_after_lockdown,
-                                                                             "after_lockdown_avg_hourly_counts"
-                                                                             , df_avg_hourly_counts_lock_down,
-                                                                             "lockdown_avg_hourly_counts"
-                                                                             , "growth_avg_hourly_counts",
-                                                                             "percent_growth")
-
-    return df_hourly_counts_growth_after_lockdown
-
-
-#### Stats 5: Peak hours traffic pattern analysis
-
-def calculate_avg_hourly_counts_by_day_time():
-    """Calculate average hourly by time (0-23 hours) in each day (Mon-Sun) in the week.
-
-    For each location, calculate average hourly by time (0-23 hours) in each day in the week.
-    This is useful for identifying peak hours in a day at a location.
-    """
-    sql_query = '''select count_stats.*
-        , sensor.sensor_description, sensor.latitude, sensor.longitude, sensor.location 
-    from 
-        ( select sensor_id, day, time, AVG(hourly_counts) as avg_hourly_counts
-        from PEDESTRIAN_PER_HOUR
-        group by sensor_id, day, time
-        ) count_stats
-    join SENSOR on count_stats.sensor_id = sensor.sensor_id '''
-
-    df = query_database(staged_db, sql_query)
-
-    return df
-
-
-#### Stats 6: Weekday vs. weekend traffic analysis
-
-def calculate_avg_hourly_counts_weekday_weekend_time():
-    """Calculate average hourly by time (0-23 hours) in weekday and weekend.
-
-    For each location, calculate average hourly by time (0-23 hours) in weekday and weekend.
-    This is useful for identifying peak hours during weekday and weekend at a location.
-    """
-    sql_query = '''select count_stats.*
-        , sensor.sensor_description, sensor.latitude, sensor.longitude, sensor.location 
-    from 
-        ( select sensor_id, day_type, time, AVG(hourly_counts) as avg_hourly_counts
-        from PEDESTRIAN_PER_HOUR
-        group by sensor_id, day_type, time
-        ) count_stats
-    join SENSOR on count_stats.sensor_id = sensor.sensor_id '''
-
-    df = query_database(staged_db, sql_query)
-
-    return df
-
-
-####################################################################################
-## Execute the whole data pipeline
-####################################################################################
-
-if __name__ == '__main__':
-    """Automated data loading and staging pipeline.
-    
-    The data pipeline architecture described in the report provides an ideal setup for a production environment 
-    with commercial and scalable systems. 
-    In this project a Python built-in SQL database system (SQLite) was used for demonstration purpose only, 
-    and the entire data pipeline workflow was run using Python (version 3.7.1).
-    """
-    print("Automated data loading and staging - Pedestrian counting system!")
-
-    # Task 1.1: Load pedestrian hourly counts from API endpoint
-    df_pedestrian_per_hour = load_data(URL_PEDESTRIAN_PER_HOUR)
-
-    # Task 1.2: Profile and QA hourly counts data
-    data_profiling(df_pedestrian_per_hour, "data profiling pedestrian per hour.html")
-
-    # Task 1.3: Cleanse, enrich and stage hourly counts dataset
-    enhance_hourly_counts_data()
-    stage_df_as_table(df_pedestrian_per_hour, staged_db, "PEDESTRIAN_PER_HOUR", "replace")
-
-    # Task 2.1: Load sensor location from API endpoint
-    df_sensor_location = load_data(URL_SENSOR_LOCATION)
-
-    # Task 2.2: Profile and QA sensor location data
-    data_profiling(df_sensor_location, "data profiling sensor location.html")
-
-    # Task 2.3: Cleanse and stage sensor location into database
-    wrangle_sensor_location()
-    stage_df_as_table(df_sensor_location, staged_db, "SENSOR", "replace")
-
-    # Task 3.1: Top N locations (most traffic) by Day
-    df_top_n_locations_by_day = calculate_stats_top_n("day")
-    stage_df_as_table(df_top_n_locations_by_day, staged_db, "TOP_N_LOCATIONS_BY_DAY", "replace")
-
-    # Task 3.2: Top N locations (most traffic) by Month
-    df_top_n_locations_by_month = calculate_stats_top_n("month")
-    stage_df_as_table(df_top_n_locations_by_month, staged_db, "TOP_N_LOCATIONS_BY_MONTH", "replace")
-
-    # Task 3.3: Locations most decline during lockdowns
-    df_hourly_counts_decline_lockdown = get_locations_most_decline()
-    stage_df_as_table(df_hourly_counts_decline_lockdown, staged_db, "HOURLY_COUNTS_DECLINE_LOCKDOWN", "replace")
-
-    # Task 3.4: Locations most growth after lockdowns
-    df_hourly_counts_growth_after_lockdown = get_locations_most_growth()
-    stage_df_as_table(df_hourly_counts_growth_after_lockdown, staged_db, "HOURLY_COUNTS_GROWTH_AFTER_LOCKDOWN",
-                      "replace")
-
-    # Task 3.5: Peak hours traffic pattern analysis
-    df_avg_hourly_counts_by_day_time = calculate_avg_hourly_counts_by_day_time()
-    stage_df_as_table(df_avg_hourly_counts_by_day_time, staged_db, "AVG_HOURLY_COUNTS_BY_DAY_TIME", "replace")
-
-    # Task 3.6: Weekday vs. weekend traffic analysis
-    df_avg_hourly_counts_weekday_weekend_time = calculate_avg_hourly_counts_weekday_weekend_time()
-    stage_df_as_table(df_avg_hourly_counts_weekday_weekend_time, staged_db, "AVG_HOURLY_COUNTS_WEEKDAY_WEEKEND",
-                      "replace")
+"""Automated data loading and staging - Pedestrian counting system.
+
+This project demonstrates an end-to-end data science project from data engineering
+(including automated data loading, wrangling, and staging) to visual analytics (interactive visualisation dashboards).
+The datasets (Pedestrian Counting System) include locations of pedestrian sensor devices across Melbourne city
+and hourly pedestrian counts from these sensors.
+
+Author: Hoang Tam Vo
+
+Version: 1.0
+"""
+
+# Import required libraries
+import asyncio  # asynchronous streaming of pages from API endpoints
+import collections  # least recently used order of the cached query results
+import contextlib  # bulk load profile of the staging database, and closing of connections
+import hashlib  # keys of the page checkpoints
+import io  # in-memory byte streams for parsing downloaded pages
+import json  # manifest of the page checkpoints
+import os  # files and directories of the page checkpoints
+import re  # tables referenced by the cached queries
+import shutil  # removal of the page checkpoints once a load is complete
+import socket  # timeouts of the page requests
+import sqlite3 as sqldb  # light-weight sql database engine for demos
+import threading  # lock for updating the checkpoint manifest from concurrent workers
+import time  # age of the cached http responses and latency of the page requests
+import urllib.error  # http errors, e.g., 304 not modified of a revalidated cached response
+import urllib.parse  # encoding of query parameters for API endpoints
+import urllib.request  # http requests to API endpoints
+import uuid  # version stamps of the staged tables
+from concurrent import futures  # pool of workers for concurrent page requests
+import pandas as pd  # data analysis and manipulation tool
+from pandas_profiling import ProfileReport  # create profiling report for a dataframe
+
+try:
+    import aiohttp  # asynchronous http client with keep-alive connection pool (optional)
+except ImportError:
+    aiohttp = None
+
+try:
+    import pyarrow as pa  # columnar in-memory format (optional)
+    import pyarrow.csv as pa_csv  # multithreaded CSV reader
+except ImportError:
+    pa = None
+
+####################################################################################
+## Define constant variables and configurations for the entire project
+####################################################################################
+
+# Location of staging database
+SQLITE_DB_FILE_NAME = "./staged_pedestrian.db"
+
+# Data sources API endpoints
+URL_SENSOR_LOCATION = "https://data.melbourne.vic.gov.au/resource/h57g-5234.csv"
+URL_PEDESTRIAN_PER_HOUR = "https://data.melbourne.vic.gov.au/resource/b2ak-trbp.csv"
+
+# Explicit schemas of the datasets, so pages are parsed with compact types instead of dtype inference:
+# integers at the narrowest width, repeated strings as categoricals, and dates as datetime64
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December"]
+DAY_TYPES = pd.CategoricalDtype(["Weekday", "Weekend"])
+SCHEMA_PEDESTRIAN_PER_HOUR = {
+    "dtype": {"id": "int32", "year": "int16", "month": pd.CategoricalDtype(MONTHS), "mdate": "int8",
+              "day": pd.CategoricalDtype(DAYS_OF_WEEK), "time": "int8", "sensor_id": "int16",
+              "sensor_name": "category", "hourly_counts": "int32"},
+    "dates": ["date_time"],
+}
+SCHEMA_SENSOR_LOCATION = {
+    "dtype": {"sensor_id": "int16", "status": "category", "direction_1": "category", "direction_2": "category"},
+    "dates": ["installation_date"],
+}
+
+# Engine parsing the pages: "c" (pandas) or "pyarrow" (optional, multithreaded, falls back to "c" if pyarrow is not
+# installed). The pyarrow engine may return other dtypes (e.g., datetime64[ms] dates and None for empty strings)
+PARSER_ENGINE = "c"
+
+# Geographical area of the sensors (latitude and longitude bounds), for validating their coordinates
+MELBOURNE_BOUNDS = ((-38.5, -37.5), (144.5, 145.5))
+
+# Size (in degrees, about 100 meters) of the cells of the grid used as a compact spatial key of the sensors
+GRID_CELL_DEGREES = 0.001
+
+# Page size (number of records) to load for each API request
+PAGE_SIZE = 50000
+
+# Http cache of the pages downloaded from API endpoints. Cached pages are revalidated with conditional requests
+# (ETag / Last-Modified), or reused without any request for HTTP_CACHE_TTL seconds if the server supports neither.
+# Pages not stored or revalidated for HTTP_CACHE_TTL seconds are removed before each run (see prune_http_cache)
+HTTP_CACHE_DIR = "./http_cache"
+HTTP_CACHE_TTL = 24 * 60 * 60
+
+# Landing directory for the pages fetched so far, which allows resuming an interrupted load
+CHECKPOINT_DIR = "./checkpoints"
+
+# Raw landing zone (local Parquet files) of the loaded datasets, allowing to rerun the pipeline without the API
+LANDING_ZONE_DIR = "./landing"
+LOAD_FROM_LANDING_ZONE = False  # rerun wrangling and stats from the landing zone instead of loading from the API
+
+# Load, enrich and stage the hourly counts chunk by chunk (page by page), which bounds the peak memory
+# by the page size instead of the dataset size. The hourly counts are not profiled in this mode.
+STREAM_HOURLY_COUNTS = False
+
+# Load only the hourly counts newer than those already staged (delta), instead of a full reload
+INCREMENTAL_LOAD = False
+
+# Adaptive page size: grows while pages are loaded quickly and stay small in memory,
+# shrinks on timeouts or oversized pages (pages are then requested one after another)
+ADAPTIVE_PAGE_SIZE = False
+PAGE_SIZE_MIN = 1000
+PAGE_SIZE_MAX = 1000000
+PAGE_TARGET_SECONDS = 10  # target latency for loading a page
+PAGE_TARGET_BYTES = 256 * 1024 * 1024  # target memory of a loaded page
+PAGE_TIMEOUT_SECONDS = 120  # timeout of a page request
+
+# Bulk staging of the dataframes: tables created with an explicit schema and rows inserted with executemany
+# in transactions of STAGING_BATCH_SIZE rows, instead of pandas to_sql (which also stores the index as a column)
+BULK_STAGING = True
+STAGING_BATCH_SIZE = 100000
+
+# Connection profiles (PRAGMA settings) of the staging database: "serving" applied once to each connection when it
+# is opened (see connect), so its page cache and memory map are kept between queries, and "bulk_load" applied only
+# while staging tables. After a bulk load, the serving settings are restored and the write-ahead log is checkpointed
+# into the database file, so the staged file is consistent. The journal mode is persistent in the database file,
+# hence only set by bulk loads, never by the read path. Negative cache sizes are in KiB.
+SQLITE_PROFILES = {
+    "bulk_load": {"journal_mode": "WAL", "synchronous": "OFF", "cache_size": -1024 * 1024, "temp_store": "MEMORY",
+                  "mmap_size": 1024 * 1024 * 1024},
+    "serving": {"synchronous": "NORMAL", "cache_size": -256 * 1024, "temp_store": "MEMORY",
+                "mmap_size": 1024 * 1024 * 1024},
+}
+
+# Rollups of the hourly counts (sum and count of the hourly counts by their columns), built once after staging
+# in a single scan each of the hourly counts table. The stats aggregate them instead of the hourly counts:
+# sum(sum_hourly_counts) / sum(count_hourly_counts) gives exactly the same averages. Ordered from the smallest.
+HOURLY_COUNTS_ROLLUPS = {
+    "ROLLUP_BY_DAY_TIME": ("sensor_id", "day", "day_type", "time"),  # Stats 1, 5 and 6
+    "ROLLUP_BY_DATE": ("sensor_id", "date_key", "day", "month", "day_type"),  # Stats 2, 3 and 4
+}
+
+# Covering indexes of the staged tables, built after the bulk load (inserts into unindexed tables are faster).
+# They are selected from the stats queries: the grouping columns of a query, then the aggregated hourly counts,
+# so each query scans a narrow index in group order instead of the whole table (SQLite can reorder the grouping
+# columns, e.g., an index by location and month also serves the grouping by month and location)
+STATS_INDEXES = {
+    "ROLLUP_BY_DATE": [
+        ("sensor_id", "month", "sum_hourly_counts", "count_hourly_counts"),  # Stats 2: top N locations by month
+        ("sensor_id", "date_key", "sum_hourly_counts", "count_hourly_counts"),  # Stats 3 and 4: periods of dates
+    ],
+    "DATE_PERIOD": [("date_key", "period")],  # Stats 3 and 4: join of the dates with their periods
+    "SENSOR": [("sensor_id",)],  # join of the stats with the sensor information
+    "PEDESTRIAN_PER_HOUR": [("id",)],  # high-water mark of the incremental loads (see get_high_water_mark)
+}
+
+# Time grains of the top N locations (Stats 1 and 2): SQL expression of the grain over the columns of the rollups,
+# and the rollup columns it needs. Only these grains are accepted, no other SQL is spliced into the queries.
+# The hour grain is not combined with a date range: no rollup has both the time and the date key (it would be as
+# large as the hourly counts table itself).
+# The ISO week (e.g., "2020-W14") is the week of the Thursday of the week of the date (its ISO year and week number)
+ISO_WEEK_THURSDAY = "date(printf('%04d-%02d-%02d', date_key / 10000, date_key / 100 % 100, date_key % 100), " \
+                    "'-3 days', 'weekday 4')"
+TOP_N_GRAINS = {
+    "hour": ("time", ["time"]),
+    "day": ("day", ["day"]),
+    "week": ("strftime('%Y', {0}) || '-W' || printf('%02d', (strftime('%j', {0}) - 1) / 7 + 1)".format(
+        ISO_WEEK_THURSDAY), ["date_key"]),
+    "month": ("month", ["month"]),
+    "year_month": ("date_key / 100", ["date_key"]),
+    "year": ("date_key / 10000", ["date_key"]),
+}
+
+# Number of top locations staged for each time period (Stats 1 and 2), None to stage the ranks of all locations
+TOP_N_MAX_RANK = None
+
+# Window functions (e.g., DENSE_RANK() OVER) are supported by SQLite since version 3.25
+SQLITE_WINDOW_FUNCTIONS = sqldb.sqlite_version_info >= (3, 25, 0)
+
+# Print the indexes used (and the full table scans) in the query plan of each query run by query_database,
+# e.g., to check a new query or index (the indexes used by the stats queries are checked by tests/test_stats.py)
+EXPLAIN_QUERIES = False
+
+# Cache of the query results, keyed by the normalized SQL and the versions of the tables it references (a new
+# version is stamped each time a table is staged). Least recently used results are evicted beyond the memory cap.
+# Results can also be persisted as Parquet files in QUERY_CACHE_DIR (None to keep them in memory only).
+# QUERY_CACHE_MAX_BYTES caps both the memory of the cached results and the size of their Parquet files.
+# These settings (and EXPLAIN_QUERIES) are read when a query is run, so they can be changed after import
+QUERY_CACHE = True
+QUERY_CACHE_MAX_BYTES = 512 * 1024 * 1024
+QUERY_CACHE_DIR = None
+
+# Number of pages requested concurrently from the API (1 to request pages one after another)
+LOAD_WORKERS = 4
+
+# Melbourne 6 lockdown periods: https://www.platinumaccounting.com.au/melbourne-lockdown-dates/
+LOCKDOWN_PERIODS = [('20200331', '20200512'), ('20200709', '20201027'), ('20210213', '20210217')
+    , ('20210528', '20211006'), ('20210716', '20210727'), ('20210805', '20211021')]
+
+
+####################################################################################
+## Utility functions for accessing staged databases
+####################################################################################
+
+def connect(database, profile="serving"):
+    """Connects to a database and applies a connection profile to the connection.
+
+    The profile is applied once, and kept for the lifetime of the connection.
+
+    Args:
+        database:
+            File name of the sql database
+        profile:
+            Name of the profile (see SQLITE_PROFILES), None to keep the default settings
+
+    Returns:
+        The connection to the sql database.
+    """
+    db_connection = sqldb.connect(database)
+    if profile is not None:
+        for name, value in SQLITE_PROFILES[profile].items():
+            db_connection.execute("PRAGMA {} = {}".format(name, value))
+    return db_connection
+
+
+staged_db = connect(SQLITE_DB_FILE_NAME)  # connect to staging database
+
+
+@contextlib.contextmanager
+def sqlite_profile(db_connection, profile):
+    """Applies a connection profile to the staging database for the duration of a with block.
+
+    The previous settings are restored at the end of the block (except the journal mode, which is persistent).
+    At the end of a "bulk_load" block, the write-ahead log is also checkpointed into the database file.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        profile:
+            Name of the profile (see SQLITE_PROFILES), None to keep the current settings
+    """
+    if profile is None:
+        yield db_connection
+        return
+
+    pragmas = SQLITE_PROFILES[profile]
+    previous = {}
+    for name in pragmas:
+        row = db_connection.execute("PRAGMA {}".format(name)).fetchone()
+        if row is not None:  # e.g., no mmap_size for an in-memory database, the setting is left as is
+            previous[name] = row[0]
+    for name, value in pragmas.items():
+        if name not in previous:
+            continue
+        if name == "journal_mode" and str(previous[name]).upper() == str(value).upper():
+            continue  # the journal mode cannot be set again within a transaction
+        db_connection.execute("PRAGMA {} = {}".format(name, value))
+    try:
+        yield db_connection
+    finally:
+        for name, value in previous.items():
+            if name != "journal_mode":
+                db_connection.execute("PRAGMA {} = {}".format(name, value))
+        if profile == "bulk_load" and str(pragmas.get("journal_mode")).upper() == "WAL":
+            db_connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def stage_df_as_table(df, db_connection, table_name, if_exists="fail", bulk=BULK_STAGING, profile="bulk_load"):
+    """Stages a dataframe.
+
+    Stores a dataframe as a table in the staging database.
+
+    Args:
+        df:
+            A dataframe (or an arrow table) to be stored into database.
+        db_connection:
+            Connection to the sql database
+        if_exists: {"fail", "replace", "append"}, default "fail"
+            How to behave if the table already exists.
+            fail: Raise a ValueError.
+            replace: Drop the table before inserting new values.
+            append: Insert new values to the existing table.
+        bulk:
+            Whether to stage with the bulk staging path (see bulk_stage_df_as_table) instead of pandas to_sql.
+        profile:
+            Connection profile applied while staging (see sqlite_profile), None to keep the current settings.
+    """
+    if pa is not None and isinstance(df, pa.Table):  # pages kept in the arrow format until staging
+        df = arrow_to_frame(df)
+    with sqlite_profile(db_connection, profile):
+        if bulk:
+            bulk_stage_df_as_table(df, db_connection, table_name, if_exists)
+        else:
+            dates = [column for column, dtype in df.dtypes.items() if pd.api.types.is_datetime64_any_dtype(dtype)]
+            df = df.assign(**{column: format_staged_dates(df[column]) for column in dates})
+            df.to_sql(table_name, db_connection, if_exists=if_exists)
+    bump_table_version(db_connection, table_name)
+
+
+def format_staged_dates(column):
+    """Formats a datetime column as the ISO text of the source datasets (e.g., "2019-11-01T17:00:00.000").
+
+    Dates are parsed as datetime64 while loading, but staged with the same text as received from the API,
+    so the staged tables (and the extracts reading them) keep the format of the source datasets.
+    """
+    return column.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").str[:-3]  # microseconds truncated to milliseconds
+
+
+def get_sqlite_type(dtype):
+    """Returns the SQLite column type of a dataframe column type (the same types as pandas to_sql).
+
+    Dates are staged as text (see format_staged_dates).
+    """
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def get_sqlite_values(column):
+    """Returns the values of a dataframe column as Python values that SQLite can store, with None for missing values.
+
+    Dates are formatted as the ISO text of the source datasets (see format_staged_dates).
+    """
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        column = format_staged_dates(column)
+    elif not column.hasnans and (pd.api.types.is_integer_dtype(column.dtype)
+                                 or pd.api.types.is_float_dtype(column.dtype)):
+        return column.tolist()  # fast path: numpy scalars converted to Python ints or floats
+    values = column.astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def bulk_stage_df_as_table(df, db_connection, table_name, if_exists="fail", batch_size=STAGING_BATCH_SIZE):
+    """Stages a dataframe with bulk inserts.
+
+    Creates the table with an explicit schema (one column per dataframe column, the index is not stored),
+    and inserts the rows with executemany in transactions of batch_size rows, which is much faster than to_sql.
+    Unless rows are appended to an existing table, they are inserted into a temporary "<table_name>__staging"
+    table which then replaces the table in a single transaction, so a failed load leaves the previous table intact.
+    Values are converted one batch at a time, so the whole dataframe is never held as Python objects.
+
+    Args:
+        df:
+            A dataframe to be stored into database.
+        db_connection:
+            Connection to the sql database
+        table_name:
+            Name of the table
+        if_exists: {"fail", "replace", "append"}, default "fail"
+            How to behave if the table already exists (see stage_df_as_table).
+        batch_size:
+            Number of rows inserted in each transaction.
+    """
+    start = time.perf_counter()
+    table_exists = db_connection.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                         (table_name,)).fetchone()[0] > 0
+    if table_exists and if_exists == "fail":
+        raise ValueError("Table '{}' already exists.".format(table_name))
+
+    append = table_exists and if_exists == "append"
+    target_table = table_name if append else table_name + "__staging"
+    columns = ", ".join('"{}" {}'.format(column, get_sqlite_type(dtype)) for column, dtype in df.dtypes.items())
+    with db_connection:
+        if not append:
+            db_connection.execute('DROP TABLE IF EXISTS "{}"'.format(target_table))  # left by a failed load
+        db_connection.execute('CREATE TABLE IF NOT EXISTS "{}" ({})'.format(target_table, columns))
+
+    insert_sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+        target_table, ", ".join('"{}"'.format(c) for c in df.columns), ", ".join("?" * len(df.columns)))
+    try:
+        for i in range(0, len(df), batch_size):
+            chunk = df.iloc[i:i + batch_size]
+            batch = list(zip(*[get_sqlite_values(chunk[column]) for column in chunk.columns]))
+            with db_connection:  # one transaction per batch
+                db_connection.executemany(insert_sql, batch)
+
+        if not append:
+            replace_table(db_connection, target_table, table_name)
+    except Exception:
+        if not append:
+            with db_connection:
+                db_connection.execute('DROP TABLE IF EXISTS "{}"'.format(target_table))
+        raise
+
+    seconds = time.perf_counter() - start
+    print("staged {} rows={} seconds={:.2f} rows/sec={:.0f}".format(table_name, len(df), seconds,
+                                                                   len(df) / max(seconds, 1e-6)))
+
+
+def replace_table(db_connection, staging_table, table_name):
+    """Replaces a table with a staging table (which is renamed) in a single transaction.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        staging_table:
+            Name of the staging table, fully loaded
+        table_name:
+            Name of the table replaced, which may not exist yet
+    """
+    with db_connection:
+        db_connection.execute("BEGIN")  # DDL statements do not open a transaction implicitly
+        db_connection.execute('DROP TABLE IF EXISTS "{}"'.format(table_name))
+        db_connection.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(staging_table, table_name))
+
+
+def query_database(db_connection, sql_query, explain=None, cache=None):
+    """Fetches data from database.
+
+    Retrieves data from the database with a provided SQL query (with the profile of the connection, see connect).
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        sql_query:
+            SQL syntax to retrieve data from the database
+        explain:
+            Whether to print the indexes used by the query (see check_query_plan), None for EXPLAIN_QUERIES.
+        cache:
+            Whether to reuse the result of the same query if the tables it references have not been staged since
+            (see get_query_cache_key), None for QUERY_CACHE.
+
+    Returns:
+        A dataframe resulted from the execution of the query in the database.
+    """
+    explain = EXPLAIN_QUERIES if explain is None else explain
+    cache = QUERY_CACHE if cache is None else cache
+    cache_key = get_query_cache_key(db_connection, sql_query) if cache else None
+    if cache_key is not None:
+        df = read_query_cache(cache_key)
+        if df is not None:
+            return df
+
+    if explain:
+        check_query_plan(db_connection, sql_query)
+    df = pd.read_sql(sql_query, db_connection)
+
+    if cache_key is not None:
+        write_query_cache(cache_key, df)
+    return df
+
+
+def create_rollups(db_connection, source_table="PEDESTRIAN_PER_HOUR", rollups=HOURLY_COUNTS_ROLLUPS):
+    """Creates (or recreates) the rollups of the hourly counts.
+
+    Each rollup is a table with the sum and count of the hourly counts by its columns, built in a single scan
+    of the source table. The count ignores missing hourly counts, like the averages computed by the stats.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        source_table:
+            Name of the staged table of hourly counts
+        rollups:
+            The columns of the rollups by table name (see HOURLY_COUNTS_ROLLUPS)
+    """
+    source_rows = db_connection.execute('SELECT count(*) FROM "{}"'.format(source_table)).fetchone()[0]
+    with sqlite_profile(db_connection, "bulk_load"):
+        for table_name, columns in rollups.items():
+            start = time.perf_counter()
+            with db_connection:
+                db_connection.execute('DROP TABLE IF EXISTS "{}"'.format(table_name))
+                db_connection.execute(
+                    '''CREATE TABLE "{}" AS
+                    SELECT {}, SUM(hourly_counts) AS sum_hourly_counts, COUNT(hourly_counts) AS count_hourly_counts
+                    FROM "{}"
+                    GROUP BY {}'''.format(table_name, ", ".join(columns), source_table, ", ".join(columns)))
+            bump_table_version(db_connection, table_name)
+            rows = db_connection.execute('SELECT count(*) FROM "{}"'.format(table_name)).fetchone()[0]
+            print("rollup {} rows={} compression={:.1f}x seconds={:.2f}".format(
+                table_name, rows, source_rows / max(rows, 1), time.perf_counter() - start))
+
+
+def get_rollup_table(columns, rollups=HOURLY_COUNTS_ROLLUPS):
+    """Returns the smallest rollup of the hourly counts having all the provided columns.
+
+    Args:
+        columns:
+            The columns needed by a query (grouping and filtering columns)
+        rollups:
+            The columns of the rollups by table name (see HOURLY_COUNTS_ROLLUPS)
+
+    Returns:
+        The name of the rollup table.
+    """
+    for table_name, rollup_columns in rollups.items():
+        if set(columns) <= set(rollup_columns):
+            return table_name
+    raise ValueError("No rollup of the hourly counts has the columns {}.".format(list(columns)))
+
+
+def get_index_name(table_name, columns):
+    """Returns the name of the index of a table on the provided columns."""
+    return "ix_{}_{}".format(table_name, "_".join(columns))
+
+
+def create_indexes(db_connection, indexes=STATS_INDEXES):
+    """Creates the indexes of the staged tables.
+
+    To be called after the tables are (bulk) loaded: building an index once is faster than maintaining it while
+    inserting. Existing indexes are kept, and the tables are analyzed so the query planner can choose the indexes.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        indexes:
+            The columns of the indexes by table name (see STATS_INDEXES)
+    """
+    with sqlite_profile(db_connection, "bulk_load"):
+        for table_name, table_indexes in indexes.items():
+            start = time.perf_counter()
+            with db_connection:
+                for columns in table_indexes:
+                    db_connection.execute('CREATE INDEX IF NOT EXISTS "{}" ON "{}" ({})'.format(
+                        get_index_name(table_name, columns), table_name, ", ".join(columns)))
+                db_connection.execute('ANALYZE "{}"'.format(table_name))
+            print("indexed {} indexes={} seconds={:.2f}".format(table_name, len(table_indexes),
+                                                               time.perf_counter() - start))
+
+
+def check_query_plan(db_connection, sql_query):
+    """Checks the query plan of a query with EXPLAIN QUERY PLAN.
+
+    Prints the indexes used by the query, and the tables it scans in full (without any index),
+    subqueries and temporary results excluded.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        sql_query:
+            SQL syntax to retrieve data from the database
+
+    Returns:
+        A tuple of the list of indexes used and the list of tables scanned in full.
+    """
+    details = [row[-1] for row in db_connection.execute("EXPLAIN QUERY PLAN " + sql_query)]
+    tables = {row[0] for row in db_connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    indexes = [detail.split(" INDEX ")[1].split(" ")[0] for detail in details if " INDEX " in detail]
+    full_scans = [detail.split(" ")[1] for detail in details
+                  if detail.startswith("SCAN ") and " INDEX " not in detail and detail.split(" ")[1] in tables]
+    print("query plan indexes={} full scans={}".format(indexes, full_scans))
+    return indexes, full_scans
+
+
+#### Query result cache
+
+query_cache = collections.OrderedDict()  # cached results (and their memory) by key, least recently used first
+query_cache_lock = threading.Lock()
+
+
+def bump_table_version(db_connection, table_name):
+    """Stamps a new version of a staged table, which invalidates the cached results of the queries on it.
+
+    The versions are kept in the TABLE_VERSION table of the staging database, so they are shared by all the
+    connections (and processes) using the database.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        table_name:
+            Name of the table that has been (re)staged
+    """
+    with db_connection:
+        db_connection.execute("CREATE TABLE IF NOT EXISTS TABLE_VERSION (table_name TEXT PRIMARY KEY, version TEXT)")
+        db_connection.execute("INSERT OR REPLACE INTO TABLE_VERSION (table_name, version) VALUES (?, ?)",
+                              (table_name, uuid.uuid4().hex))
+
+
+def get_query_cache_key(db_connection, sql_query):
+    """Gets the key of the cached result of a query.
+
+    The key is a hash of the SQL query (with whitespaces normalized) and of the versions of the tables it references
+    (tables whose names appear in the query). Results of queries referencing a table without version, i.e., not
+    staged with stage_df_as_table, or no table at all, and queries of the schema (sqlite_master) are not cached.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        sql_query:
+            SQL syntax to retrieve data from the database
+
+    Returns:
+        The key of the query result, or None if it cannot be cached.
+    """
+    tables = [row[0] for row in db_connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if "TABLE_VERSION" not in tables or "sqlite_master" in sql_query.lower():
+        return None
+    versions = dict(db_connection.execute("SELECT table_name, version FROM TABLE_VERSION"))
+    referenced = sorted(table for table in tables
+                        if re.search(r"\b{}\b".format(re.escape(table)), sql_query, re.IGNORECASE))
+    if not referenced or any(table not in versions for table in referenced):
+        return None
+
+    normalized_query = " ".join(sql_query.split())
+    key = json.dumps([normalized_query, [(table, versions[table]) for table in referenced]])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def read_query_cache(key, cache_dir=None):
+    """Reads a cached query result, from memory or else from its Parquet file.
+
+    Args:
+        key:
+            The key of the query result (see get_query_cache_key)
+        cache_dir:
+            Directory of the Parquet files of the cached results, None for QUERY_CACHE_DIR
+
+    Returns:
+        A copy of the cached result (callers may modify it), or None if it is not cached.
+    """
+    with query_cache_lock:
+        if key in query_cache:
+            query_cache.move_to_end(key)  # most recently used
+            df = query_cache[key][0]
+            print("query rows={} source=cache".format(df.shape[0]))
+            return df.copy()
+
+    cache_dir = QUERY_CACHE_DIR if cache_dir is None else cache_dir
+    file_name = os.path.join(cache_dir, key + ".parquet") if cache_dir and pa is not None else None
+    if file_name is None or not os.path.exists(file_name):
+        return None
+    df = pd.read_parquet(file_name)
+    os.utime(file_name)  # most recently used (see prune_query_cache_dir)
+    print("query rows={} source=parquet".format(df.shape[0]))
+    write_query_cache(key, df, cache_dir=False)
+    return df.copy()
+
+
+def write_query_cache(key, df, max_bytes=None, cache_dir=None):
+    """Caches a query result, evicting the least recently used results beyond the size cap.
+
+    Args:
+        key:
+            The key of the query result (see get_query_cache_key)
+        df:
+            The query result
+        max_bytes:
+            Maximum memory of the cached results, and maximum size of their Parquet files, a result larger than
+            that is not kept. None for QUERY_CACHE_MAX_BYTES.
+        cache_dir:
+            Directory where the result is also persisted as a Parquet file (requires pyarrow), None for
+            QUERY_CACHE_DIR, False to keep the result in memory only
+    """
+    max_bytes = QUERY_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    cache_dir = QUERY_CACHE_DIR if cache_dir is None else cache_dir
+    memory = df.memory_usage(index=True, deep=True).sum()
+    with query_cache_lock:
+        if memory <= max_bytes:
+            query_cache[key] = (df.copy(), memory)
+            while sum(memory for (_, memory) in query_cache.values()) > max_bytes:
+                query_cache.popitem(last=False)  # least recently used
+
+        if cache_dir and pa is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            df.to_parquet(os.path.join(cache_dir, key + ".parquet"))
+            prune_query_cache_dir(cache_dir, max_bytes)
+
+
+def prune_query_cache_dir(cache_dir, max_bytes):
+    """Removes the least recently used Parquet files of the cached results beyond the size cap.
+
+    Files are used in order of their modification time, which is updated when a file is read.
+
+    Args:
+        cache_dir:
+            Directory of the Parquet files of the cached results
+        max_bytes:
+            Maximum size of the Parquet files
+    """
+    files = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(".parquet") and entry.is_file()]
+    files.sort(key=lambda entry: entry.stat().st_mtime)  # least recently used first
+    total_bytes = sum(entry.stat().st_size for entry in files)
+    for entry in files:
+        if total_bytes <= max_bytes:
+            break
+        total_bytes -= entry.stat().st_size
+        os.remove(entry.path)
+
+
+####################################################################################
+## Data loading, profiling, cleansing, enhancing
+####################################################################################
+
+def build_endpoint(url, limit, offset, query=None):
+    """Builds the API endpoint of a page.
+
+    Args:
+        url:
+            API endpoint
+        limit:
+            Page size (number of records) to load for the request
+        offset:
+            Position of the first record of the page in the whole table
+        query:
+            Optional dictionary of extra query parameters, e.g., {"$where": "id > 100", "$order": "id"}
+
+    Returns:
+        The API endpoint of the page.
+    """
+    endpoint = "{}?$limit={}&$offset={}".format(url, limit, offset)  # load a page from an offset
+    if query:
+        endpoint += "&" + urllib.parse.urlencode(query, safe="$,", quote_via=urllib.parse.quote)
+    return endpoint
+
+
+def fetch_page(endpoint, timeout=None):
+    """Fetches a page from API endpoint.
+
+    Downloads the raw body of a page (a CSV document) from the provided API endpoint.
+
+    Args:
+        endpoint:
+            API endpoint of the page, including paging parameters
+        timeout:
+            Optional timeout of the request in seconds
+
+    Returns:
+        The raw bytes of the page body.
+    """
+    with urllib.request.urlopen(endpoint, **({"timeout": timeout} if timeout else {})) as response:
+        return response.read()
+
+
+def read_http_cache(cache_dir, endpoint):
+    """Reads the cached response of an API endpoint.
+
+    Returns:
+        A tuple of the raw bytes of the cached page body and its metadata (validators and time it was stored),
+        or (None, None) if the endpoint has not been cached, or if the body does not match its metadata.
+    """
+    key = hashlib.sha1(endpoint.encode()).hexdigest()
+    metadata_file = os.path.join(cache_dir, key + ".json")
+    body_file = os.path.join(cache_dir, key + ".csv")
+    if not os.path.exists(metadata_file) or not os.path.exists(body_file):
+        return None, None
+    with open(metadata_file) as f:
+        metadata = json.load(f)
+    with open(body_file, "rb") as f:
+        body = f.read()
+    if metadata.get("body_sha1") != hashlib.sha1(body).hexdigest():
+        return None, None
+    return body, metadata
+
+
+def write_http_cache(cache_dir, endpoint, body, etag=None, last_modified=None):
+    """Writes the response of an API endpoint into the cache.
+
+    The body and its metadata are each written to a temporary file which then replaces the cached file, so a cached
+    file is never left truncated. The metadata also holds a digest of its body: a body which does not match it
+    (e.g., a write interrupted between the two files) is never taken for a cached response.
+    A body of None keeps the cached body, and only refreshes its metadata (e.g., after a revalidation).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = hashlib.sha1(endpoint.encode()).hexdigest()
+    body_file = os.path.join(cache_dir, key + ".csv")
+    if body is not None:
+        with open(body_file + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(body_file + ".tmp", body_file)
+    else:
+        with open(body_file, "rb") as f:
+            body = f.read()
+
+    metadata = {"endpoint": endpoint, "etag": etag, "last_modified": last_modified, "stored_at": time.time(),
+                "body_sha1": hashlib.sha1(body).hexdigest()}
+    metadata_file = os.path.join(cache_dir, key + ".json")
+    with open(metadata_file + ".tmp", "w") as f:
+        json.dump(metadata, f)
+    os.replace(metadata_file + ".tmp", metadata_file)
+
+
+def prune_http_cache(cache_dir, ttl=HTTP_CACHE_TTL):
+    """Removes the pages of the http cache which were not stored or revalidated for ttl seconds.
+
+    Without pruning, the cache would keep growing, as the endpoints change from run to run
+    (e.g., adaptive page sizes, or the high-water mark of incremental loads).
+
+    Args:
+        cache_dir:
+            Directory of the http cache
+        ttl:
+            Number of seconds after which an unused page is removed
+
+    Returns:
+        The number of pages removed.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    expired = [entry.name[:-len(".json")] for entry in os.scandir(cache_dir)
+               if entry.name.endswith(".json") and time.time() - entry.stat().st_mtime >= ttl]
+    for key in expired:
+        for extension in (".json", ".csv", ".json.tmp", ".csv.tmp"):
+            file_name = os.path.join(cache_dir, key + extension)
+            if os.path.exists(file_name):
+                os.remove(file_name)
+    print("{} pages removed from the http cache {}".format(len(expired), cache_dir))
+    return len(expired)
+
+
+def fetch_page_cached(endpoint, cache_dir, ttl=HTTP_CACHE_TTL, timeout=None):
+    """Fetches a page from API endpoint through the http cache.
+
+    A cached page is revalidated with a conditional request if the server provided a validator
+    (ETag or Last-Modified) and reused if the server answers 304 not modified.
+    If the server provided no validator, a cached page is reused without any request until it is older than ttl.
+
+    Args:
+        endpoint:
+            API endpoint of the page, including paging parameters
+        cache_dir:
+            Directory of the http cache
+        ttl:
+            Number of seconds a cached page without validator is reused for
+        timeout:
+            Optional timeout of the request in seconds
+
+    Returns:
+        A tuple of the raw bytes of the page body and how it was obtained:
+        "cache" (reused without request), "revalidated" (reused after 304 not modified) or "api" (downloaded).
+    """
+    body, metadata = read_http_cache(cache_dir, endpoint)
+    headers = {}
+    if body is not None:
+        if metadata["etag"] is None and metadata["last_modified"] is None:
+            if time.time() - metadata["stored_at"] < ttl:
+                return body, "cache"
+        else:
+            if metadata["etag"] is not None:
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata["last_modified"] is not None:
+                headers["If-Modified-Since"] = metadata["last_modified"]
+
+    try:
+        request = urllib.request.Request(endpoint, headers=headers)
+        with urllib.request.urlopen(request, **({"timeout": timeout} if timeout else {})) as response:
+            new_body = response.read()
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as error:
+        if error.code != 304 or body is None:
+            raise
+        write_http_cache(cache_dir, endpoint, None, metadata["etag"], metadata["last_modified"])  # refresh age
+        return body, "revalidated"
+
+    write_http_cache(cache_dir, endpoint, new_body, etag, last_modified)
+    return new_body, "api"
+
+
+def get_arrow_type(dtype):
+    """Gets the arrow type corresponding to a pandas type of a schema."""
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.type_for_alias(dtype)
+
+
+def parse_page_arrow(body, schema=None):
+    """Parses a page into an arrow table.
+
+    Uses the multithreaded CSV reader of pyarrow, and keeps the page in the arrow columnar format.
+
+    Args:
+        body:
+            The raw bytes of a page (a CSV document)
+        schema:
+            Optional schema of the dataset (see parse_page)
+
+    Returns:
+        An arrow table containing the records of the page (empty if the page has no content).
+    """
+    if not body.strip():  # nothing at all was returned, e.g., offset beyond the end of table
+        return pa.table({})
+
+    column_types = {}
+    if schema is not None:
+        column_types = {column: get_arrow_type(dtype) for column, dtype in schema["dtype"].items()}
+        column_types.update({column: pa.timestamp("ms") for column in schema["dates"]})
+    return pa_csv.read_csv(io.BytesIO(body),
+                           parse_options=pa_csv.ParseOptions(newlines_in_values=True),  # e.g., in location
+                           convert_options=pa_csv.ConvertOptions(column_types=column_types,
+                                                                 strings_can_be_null=True))
+
+
+def arrow_to_frame(table, schema=None):
+    """Converts an arrow table into a dataframe.
+
+    Args:
+        table:
+            An arrow table, e.g., the pages loaded with the "pyarrow" engine
+        schema:
+            Optional schema of the dataset (see parse_page), to restore the categories of categorical columns
+
+    Returns:
+        A dataframe containing the records of the table.
+    """
+    df = table.to_pandas()
+    if schema is not None:
+        for column, dtype in schema["dtype"].items():
+            if isinstance(dtype, pd.CategoricalDtype) and column in df:
+                df[column] = df[column].cat.set_categories(dtype.categories)
+    return df
+
+
+def parse_page(body, schema=None, engine="c"):
+    """Parses a page into a dataframe.
+
+    Args:
+        body:
+            The raw bytes of a page (a CSV document)
+        schema:
+            Optional schema of the dataset (e.g., SCHEMA_PEDESTRIAN_PER_HOUR), with the types of the columns
+            ("dtype") and the date columns ("dates"). Without a schema, the types are inferred.
+        engine:
+            "c" to parse with pandas, or "pyarrow" to parse into an arrow table (see parse_page_arrow)
+
+    Returns:
+        A dataframe (or an arrow table with the "pyarrow" engine) containing the records of the page,
+        empty if the page has no content.
+    """
+    if engine == "pyarrow":
+        return parse_page_arrow(body, schema)
+    if not body.strip():  # nothing at all was returned, e.g., offset beyond the end of table
+        return pd.DataFrame()
+    if schema is None:
+        return pd.read_csv(io.BytesIO(body))
+
+    df = pd.read_csv(io.BytesIO(body), dtype=schema["dtype"])
+    for column in schema["dates"]:
+        if column in df:  # the column may have been left out by a column projection
+            df[column] = pd.to_datetime(df[column])
+    return df
+
+
+def concat_pages(pages):
+    """Concatenates pages into a dataframe.
+
+    The categories of each categorical column are unified across the pages beforehand,
+    so the column stays categorical in the result instead of falling back to python strings.
+
+    Args:
+        pages:
+            List of dataframes (or arrow tables), one for each page
+
+    Returns:
+        A dataframe (or an arrow table) containing the records of all the pages.
+    """
+    if pa is not None and isinstance(pages[0], pa.Table):
+        return pa.concat_tables([page for page in pages if page.shape[0] > 0] or pages[:1])
+
+    pages = [page for page in pages if page.shape[0] > 0] or pages[:1]  # skip empty pages, e.g., beyond the end
+    for column in pages[0].columns:
+        if all(isinstance(page[column].dtype, pd.CategoricalDtype) for page in pages):
+            categories = pd.api.types.union_categoricals([page[column] for page in pages]).categories
+            for page in pages:
+                page[column] = page[column].cat.set_categories(categories)
+    return pd.concat(pages)
+
+
+def get_checkpoint_dir(checkpoint_root, url, query=None):
+    """Gets the checkpoint directory of an API endpoint.
+
+    The pages of each endpoint (and its extra query parameters) are kept in their own directory,
+    together with a manifest.json file describing the pages stored so far.
+
+    Returns:
+        Path of the checkpoint directory of the endpoint.
+    """
+    key = hashlib.sha1(json.dumps([url, query], sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(checkpoint_root, key)
+
+
+def read_checkpoint_manifest(checkpoint_dir):
+    """Reads the manifest of a checkpoint directory.
+
+    Returns:
+        A dictionary describing the endpoint and its pages stored so far (keyed by offset).
+    """
+    manifest_file = os.path.join(checkpoint_dir, "manifest.json")
+    if not os.path.exists(manifest_file):
+        return {"pages": {}}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def read_page_checkpoint(checkpoint_dir, limit, offset):
+    """Reads a page from the checkpoint directory.
+
+    Returns:
+        The raw bytes of the page body, or None if the page (with the same page size) has not been stored.
+    """
+    page_info = read_checkpoint_manifest(checkpoint_dir)["pages"].get(str(offset))
+    if page_info is None or page_info["limit"] != limit:
+        return None
+    with open(os.path.join(checkpoint_dir, page_info["file"]), "rb") as f:
+        return f.read()
+
+
+checkpoint_lock = threading.Lock()  # the manifest is shared by all the workers loading the same endpoint
+
+
+def write_page_checkpoint(checkpoint_dir, endpoint, limit, offset, body):
+    """Writes a page into the checkpoint directory and records it in the manifest.
+
+    The page file is fully written before being recorded, so an interrupted write is never taken for a page.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    page_file = "{}.csv".format(offset)
+    with open(os.path.join(checkpoint_dir, page_file), "wb") as f:
+        f.write(body)
+
+    with checkpoint_lock:
+        manifest = read_checkpoint_manifest(checkpoint_dir)
+        manifest["pages"][str(offset)] = {"endpoint": endpoint, "limit": limit, "file": page_file, "bytes": len(body)}
+        manifest_file = os.path.join(checkpoint_dir, "manifest.json")
+        with open(manifest_file + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def load_page(url, limit, offset, query=None, checkpoint_dir=None, schema=None, engine="c", cache_dir=None,
+              timeout=None):
+    """Loads a page from API endpoint.
+
+    Requests and parses the page of records starting from an offset.
+    Reports the endpoint, number of rows and number of bytes of the page,
+    which allows confirming that loading scales linearly with the size of the table.
+
+    Args:
+        url:
+            API endpoint
+        limit:
+            Page size (number of records) to load for the request
+        offset:
+            Position of the first record of the page in the whole table
+        query:
+            Optional dictionary of extra query parameters (see build_endpoint)
+        checkpoint_dir:
+            Optional checkpoint directory of the endpoint (see get_checkpoint_dir).
+            The page is read from there if it has been stored by a previous run, otherwise it is stored there.
+        schema:
+            Optional schema of the dataset (see parse_page)
+        engine:
+            Engine parsing the page (see parse_page)
+        cache_dir:
+            Optional directory of the http cache (see fetch_page_cached)
+        timeout:
+            Optional timeout of the request in seconds
+
+    Returns:
+        A dataframe (or an arrow table with the "pyarrow" engine) containing the records of the page.
+    """
+    endpoint = build_endpoint(url, limit, offset, query)
+    body = read_page_checkpoint(checkpoint_dir, limit, offset) if checkpoint_dir else None
+    if body is None:
+        if cache_dir:
+            body, source = fetch_page_cached(endpoint, cache_dir, timeout=timeout)
+        else:
+            body, source = fetch_page(endpoint, timeout), "api"
+        if checkpoint_dir:
+            write_page_checkpoint(checkpoint_dir, endpoint, limit, offset, body)
+    else:
+        source = "checkpoint"
+    page = parse_page(body, schema, engine)
+    print("{} rows={} bytes={} source={}".format(endpoint, page.shape[0], len(body), source))
+    return page
+
+
+def iter_pages(url, limit=PAGE_SIZE, query=None, checkpoint_dir=None, schema=None, engine="c", cache_dir=None):
+    """Iterates over the pages of an API endpoint.
+
+    Requests the pages one after another and yields each of them as soon as it is parsed.
+
+    Args:
+        url:
+            API endpoint
+        limit:
+            Page size (number of records) to load for each request
+        query:
+            Optional dictionary of extra query parameters (see build_endpoint)
+        checkpoint_dir:
+            Optional checkpoint directory of the endpoint (see load_page)
+        schema:
+            Optional schema of the dataset (see parse_page)
+        engine:
+            Engine parsing the pages (see parse_page)
+        cache_dir:
+            Optional directory of the http cache (see fetch_page_cached)
+
+    Yields:
+        A dataframe (or an arrow table with the "pyarrow" engine) for each page retrieved from the data source.
+    """
+    i = 0
+    while True:
+        page = load_page(url, limit, i * limit, query, checkpoint_dir, schema, engine, cache_dir)
+        yield page
+        i += 1
+        if page.shape[0] < limit:  # this is last page of the whole table
+            break
+
+
+def get_page_memory(page):
+    """Gets the memory (number of bytes) used by a loaded page (a dataframe or an arrow table)."""
+    if pa is not None and isinstance(page, pa.Table):
+        return page.nbytes
+    return page.memory_usage(deep=True).sum()
+
+
+def is_timeout(error):
+    """Checks whether an error raised by a page request is a timeout."""
+    return isinstance(error, socket.timeout) or isinstance(getattr(error, "reason", None), socket.timeout)
+
+
+def next_page_size(limit, seconds, memory):
+    """Adapts the page size to the latency and memory of the last loaded page.
+
+    Doubles the page size while the page is loaded well within the target latency and memory,
+    halves it as soon as one of the targets is exceeded.
+
+    Args:
+        limit:
+            Page size (number of records) of the last loaded page
+        seconds:
+            Time taken to load the last page
+        memory:
+            Memory (number of bytes) used by the last page
+
+    Returns:
+        The page size for the next request, between PAGE_SIZE_MIN and PAGE_SIZE_MAX.
+    """
+    if seconds > PAGE_TARGET_SECONDS or memory > PAGE_TARGET_BYTES:
+        limit //= 2
+    elif seconds < PAGE_TARGET_SECONDS / 2 and memory < PAGE_TARGET_BYTES / 2:
+        limit *= 2
+    return max(PAGE_SIZE_MIN, min(PAGE_SIZE_MAX, limit))
+
+
+def iter_pages_adaptive(url, limit=PAGE_SIZE, query=None, checkpoint_dir=None, schema=None, engine="c",
+                        cache_dir=None):
+    """Iterates over the pages of an API endpoint with an adaptive page size.
+
+    Requests the pages one after another, adapting the page size after each page (see next_page_size),
+    and retrying a page with half of the page size if its request times out.
+    Each page starts right after the records of the previous one. A page having less records than its page size
+    is not taken as the last page, since the API may cap the page size below the requested one: the page size is
+    then capped to the size of that page, and the first empty page is the end of the whole table.
+
+    Args:
+        url:
+            API endpoint
+        limit:
+            Page size (number of records) of the first request
+        query:
+            Optional dictionary of extra query parameters (see build_endpoint)
+        checkpoint_dir:
+            Optional checkpoint directory of the endpoint (see load_page).
+            Pages stored by a previous run are reused with the page size they were loaded with.
+        schema:
+            Optional schema of the dataset (see parse_page)
+        engine:
+            Engine parsing the pages (see parse_page)
+        cache_dir:
+            Optional directory of the http cache (see fetch_page_cached)
+
+    Yields:
+        A dataframe (or an arrow table with the "pyarrow" engine) for each page retrieved from the data source.
+    """
+    offset = 0
+    max_limit = PAGE_SIZE_MAX
+    while True:
+        if checkpoint_dir:
+            page_info = read_checkpoint_manifest(checkpoint_dir)["pages"].get(str(offset))
+            if page_info is not None:
+                limit = page_info["limit"]
+
+        start = time.time()
+        try:
+            page = load_page(url, limit, offset, query, checkpoint_dir, schema, engine, cache_dir,
+                             PAGE_TIMEOUT_SECONDS)
+        except OSError as error:  # includes socket and url errors
+            if not is_timeout(error) or limit <= PAGE_SIZE_MIN:
+                raise
+            limit = max(PAGE_SIZE_MIN, limit // 2)
+            print("{} timed out at offset {}, retrying with page size {}".format(url, offset, limit))
+            continue
+        yield page
+
+        if page.shape[0] == 0:  # this is the end of the whole table
+            break
+        if page.shape[0] < limit:  # the end of the table, or the page size is capped by the API
+            max_limit = max(PAGE_SIZE_MIN, page.shape[0])
+        offset += page.shape[0]
+        limit = min(max_limit, next_page_size(limit, time.time() - start, get_page_memory(page)))
+
+
+def count_records(url, query=None, timeout=None):
+    """Counts the records of an API endpoint with a $select=count(*) request.
+
+    Args:
+        url:
+            API endpoint
+        query:
+            Optional dictionary of extra query parameters (see build_endpoint), only the $where filter is kept
+        timeout:
+            Optional timeout of the request in seconds
+
+    Returns:
+        The number of records of the endpoint matching the query.
+    """
+    count_query = {"$select": "count(*)"}
+    if query and "$where" in query:
+        count_query["$where"] = query["$where"]
+    endpoint = "{}?{}".format(url, urllib.parse.urlencode(count_query, safe="$,()*", quote_via=urllib.parse.quote))
+    count = int(pd.read_csv(io.BytesIO(fetch_page(endpoint, timeout))).iloc[0, 0])
+    print("{} count={}".format(endpoint, count))
+    return count
+
+
+def load_pages_concurrently(url, limit=PAGE_SIZE, workers=LOAD_WORKERS, query=None, checkpoint_dir=None,
+                            schema=None, engine="c", cache_dir=None):
+    """Loads the pages of an API endpoint concurrently.
+
+    The first page is requested alone: if it has less than limit records, it is the whole table.
+    Otherwise the end of the table is probed with a count request (see count_records), and the remaining pages
+    are requested by a bounded pool of workers, so no request is wasted beyond the end of the table.
+    As records may have been added after the count, the pages following a full last page are requested one after
+    another until a page has less than limit records (as in iter_pages).
+    The pages are returned in offset order, hence the result is the same as requesting them one after another.
+
+    Args:
+        url:
+            API endpoint
+        limit:
+            Page size (number of records) to load for each request
+        workers:
+            Maximum number of pages requested at the same time
+        query:
+            Optional dictionary of extra query parameters (see build_endpoint)
+        checkpoint_dir:
+            Optional checkpoint directory of the endpoint (see load_page)
+        schema:
+            Optional schema of the dataset (see parse_page)
+        engine:
+            Engine parsing the pages (see parse_page)
+        cache_dir:
+            Optional directory of the http cache (see fetch_page_cached)
+
+    Returns:
+        A list of dataframes (or arrow tables with the "pyarrow" engine), one for each page, in offset order.
+    """
+    pages = [load_page(url, limit, 0, query, checkpoint_dir, schema, engine, cache_dir)]
+    if pages[0].shape[0] < limit:  # the first page is the whole table
+        return pages
+
+    count = count_records(url, query)
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pages += executor.map(lambda offset: load_page(url, limit, offset, query, checkpoint_dir, schema, engine,
+                                                       cache_dir), range(limit, count, limit))
+
+    offset = len(pages) * limit
+    while pages[-1].shape[0] == limit:  # records may have been added after the count
+        pages.append(load_page(url, limit, offset, query, checkpoint_dir, schema, engine, cache_dir))
+        offset += limit
+    return pages
+
+
+def load_data(url, limit=PAGE_SIZE, workers=1, query=None, checkpoint_root=None, schema=None, select=None,
+              engine="c", as_arrow=False, cache_dir=None, adaptive=False):
+    """Load data from API endpoint.
+
+    Retrieves data from data sources with the provided API endpoint.
+    Pages are collected into a list and concatenated once at the end,
+    so the loading time and memory grow linearly with the size of the table.
+    With a checkpoint directory, every fetched page is also stored on disk, so a failed load can be rerun
+    and resumed from the first missing page. The checkpoints are removed once the load is complete.
+
+    Args:
+        url:
+            API endpoint
+        limit:
+            Page size (number of records) to load for each request
+        workers:
+            Number of pages requested concurrently (1 to request pages one after another)
+        query:
+            Optional dictionary of extra query parameters (see build_endpoint)
+        checkpoint_root:
+            Optional landing directory for page checkpoints (e.g., CHECKPOINT_DIR)
+        schema:
+            Optional schema of the dataset (see parse_page)
+        select:
+            Optional list of columns to retrieve, the projection is pushed to the API with a $select parameter
+        engine:
+            Engine parsing the pages: "c" (pandas) or "pyarrow" (multithreaded CSV reader of pyarrow).
+            Falls back to "c" if pyarrow is not installed.
+        as_arrow:
+            With the "pyarrow" engine, keep the pages in the arrow columnar format until staging
+            and return an arrow table instead of a dataframe
+        cache_dir:
+            Optional directory of the http cache (e.g., HTTP_CACHE_DIR), see fetch_page_cached
+        adaptive:
+            Adapt the page size to the latency and memory of the pages, starting from limit
+            (see iter_pages_adaptive). The pages are then requested one after another.
+
+    Returns:
+        A dataframe (or an arrow table with as_arrow) retrieved from the data source.
+    """
+    if engine == "pyarrow" and pa is None:
+        print("pyarrow is not installed, falling back to the c parser engine")
+        engine = "c"
+    if select:
+        query = dict(query or {}, **{"$select": ",".join(select)})
+    checkpoint_dir = get_checkpoint_dir(checkpoint_root, url, query) if checkpoint_root else None
+    if adaptive:
+        pages = list(iter_pages_adaptive(url, limit, query, checkpoint_dir, schema, engine, cache_dir))
+    elif workers > 1:
+        pages = load_pages_concurrently(url, limit, workers, query, checkpoint_dir, schema, engine, cache_dir)
+    else:
+        pages = list(iter_pages(url, limit, query, checkpoint_dir, schema, engine, cache_dir))
+    df = concat_pages(pages)
+    if engine == "pyarrow" and not as_arrow:
+        df = arrow_to_frame(df, schema)
+    print("{} pages={} rows={}".format(url, len(pages), df.shape[0]))
+
+    if checkpoint_dir and os.path.isdir(checkpoint_dir):  # the load is complete, checkpoints are not needed anymore
+        shutil.rmtree(checkpoint_dir)
+    return df
+
+
+def get_high_water_mark(db_connection, table_name, column="id"):
+    """Gets the high-water mark of a staged table.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        table_name:
+            Name of the staged table
+        column:
+            Monotonically increasing column of the table (e.g., the record id)
+
+    Returns:
+        The maximum value of the column in the staged table, or None if the table has not been staged yet.
+    """
+    sql_query = "select name from sqlite_master where type = 'table' and name = '{}'".format(table_name)
+    if query_database(db_connection, sql_query).empty:
+        return None
+
+    sql_query = "select max({}) as high_water_mark from {}".format(column, table_name)
+    high_water_mark = query_database(db_connection, sql_query)["high_water_mark"][0]
+    return None if pd.isna(high_water_mark) else int(high_water_mark)
+
+
+def get_delta_query(db_connection, table_name, column="id"):
+    """Gets the query parameters for loading new data (delta) from API endpoint.
+
+    Returns:
+        A dictionary of query parameters (see build_endpoint) selecting the records whose id is greater than
+        the maximum id already staged in the table, or None if the table has not been staged yet.
+    """
+    high_water_mark = get_high_water_mark(db_connection, table_name, column)
+    if high_water_mark is None:
+        return None
+
+    # order the records by id, so the paging is stable
+    return {"$where": "{} > {}".format(column, high_water_mark), "$order": column}
+
+
+def open_api_session(connections=LOAD_WORKERS):
+    """Opens an asynchronous http session to API endpoints.
+
+    The session holds a single pool of keep-alive connections, which is meant to be shared by
+    all API endpoints (e.g., both sensor location and hourly counts) for the whole loading.
+
+    Args:
+        connections:
+            Maximum number of connections kept open in the pool
+
+    Returns:
+        An aiohttp client session, to be used as an asynchronous context manager.
+    """
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for streaming pages asynchronously")
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections))
+
+
+async def fetch_page_async(session, endpoint):
+    """Fetches a page from API endpoint using a connection of the session pool.
+
+    Returns:
+        The raw bytes of the page body.
+    """
+    async with session.get(endpoint) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def stream_pages(session, url, limit=PAGE_SIZE, query=None, schema=None):
+    """Streams the pages of an API endpoint.
+
+    Yields each page as soon as it is parsed, instead of building one big dataframe,
+    so downstream wrangling and staging can start while later pages are still downloading.
+    Pages are parsed in a worker thread. After a full page, the next page is downloaded while the current one
+    is consumed by the caller (no page is requested after a page with less than limit records, the last one).
+
+    Args:
+        session:
+            Http session opened with open_api_session
+        url:
+            API endpoint
+        limit:
+            Page size (number of records) to load for each request
+        query:
+            Optional dictionary of extra query parameters (see build_endpoint)
+        schema:
+            Optional schema of the dataset (see parse_page)
+
+    Yields:
+        A dataframe for each page retrieved from the data source.
+    """
+    loop = asyncio.get_running_loop()
+    offset = 0
+    endpoint = build_endpoint(url, limit, offset, query)
+    next_body = asyncio.ensure_future(fetch_page_async(session, endpoint))
+    try:
+        while next_body is not None:
+            body = await next_body
+            next_body = None
+            page = await loop.run_in_executor(None, parse_page, body, schema)
+            print("{} rows={} bytes={}".format(endpoint, page.shape[0], len(body)))
+
+            if page.shape[0] == limit:  # request the following page in the background, unless this is the last one
+                offset += limit
+                endpoint = build_endpoint(url, limit, offset, query)
+                next_body = asyncio.ensure_future(fetch_page_async(session, endpoint))
+            yield page
+    finally:
+        if next_body is not None:  # the caller stopped before the end of the table
+            next_body.cancel()
+
+
+async def load_data_async(urls, limit=PAGE_SIZE, schemas=None):
+    """Load data from several API endpoints asynchronously.
+
+    Streams the pages of all the endpoints at the same time over one shared pool of keep-alive connections.
+
+    Args:
+        urls:
+            List of API endpoints
+        limit:
+            Page size (number of records) to load for each request
+        schemas:
+            Optional list of schemas of the datasets (see parse_page), in the same order as the endpoints
+
+    Returns:
+        A list of dataframes retrieved from the data sources, in the same order as the endpoints.
+    """
+    async def collect(session, url, schema):
+        pages = [page async for page in stream_pages(session, url, limit, schema=schema)]
+        return concat_pages(pages)
+
+    schemas = schemas or [None] * len(urls)
+    async with open_api_session() as session:
+        return await asyncio.gather(*[collect(session, url, schema) for url, schema in zip(urls, schemas)])
+
+
+#### Raw landing zone in Parquet
+
+def write_landing_zone(df, dataset_name, partition_cols=None, append=False, landing_dir=LANDING_ZONE_DIR):
+    """Writes a loaded dataset into the raw landing zone.
+
+    Stores the dataset in the columnar Parquet format, either as a directory partitioned
+    by the provided columns (e.g., year and month) or as a single file.
+
+    Args:
+        df:
+            A dataframe loaded from the data source
+        dataset_name:
+            Name of the dataset in the landing zone (e.g., "pedestrian_per_hour")
+        partition_cols:
+            Optional list of columns to partition the dataset by
+        append:
+            Add the records to those already in the landing zone (e.g., new records of an incremental load),
+            instead of replacing them
+        landing_dir:
+            Directory of the landing zone
+    """
+    if df.shape[0] == 0:
+        return
+    if partition_cols:
+        path = os.path.join(landing_dir, dataset_name)
+        if os.path.isdir(path) and not append:
+            shutil.rmtree(path)
+        df.to_parquet(path, partition_cols=partition_cols, index=False)
+    else:
+        os.makedirs(landing_dir, exist_ok=True)
+        path = os.path.join(landing_dir, dataset_name + ".parquet")
+        if os.path.exists(path) and append:
+            df = pd.concat([pd.read_parquet(path), df])
+        df.to_parquet(path, index=False)
+    print("{} rows={} written to landing zone {}".format(dataset_name, df.shape[0], path))
+
+
+def read_landing_zone(dataset_name, schema=None, landing_dir=LANDING_ZONE_DIR):
+    """Reads a dataset from the raw landing zone.
+
+    Args:
+        dataset_name:
+            Name of the dataset in the landing zone (e.g., "pedestrian_per_hour")
+        schema:
+            Optional schema of the dataset (see parse_page), to restore the types of the partition columns
+        landing_dir:
+            Directory of the landing zone
+
+    Returns:
+        A dataframe containing the records of the dataset.
+    """
+    path = os.path.join(landing_dir, dataset_name)
+    if not os.path.isdir(path):
+        path += ".parquet"
+    df = pd.read_parquet(path)
+    if schema is not None:
+        for column, dtype in schema["dtype"].items():
+            if column in df and df[column].dtype != dtype:
+                df[column] = df[column].astype(dtype)
+    print("{} rows={} read from landing zone {}".format(dataset_name, df.shape[0], path))
+    return df
+
+
+profiling_lock = threading.Lock()  # reports are created one at a time, as plotting is not thread-safe
+
+
+def data_profiling(df, report_html_filename):
+    """Profiles data of a dataframe
+
+    Creates a data profiling report of a dataframe and write the report to an html file.
+    """
+    with profiling_lock:
+        profile = ProfileReport(df)
+        profile.to_file(report_html_filename)
+
+
+def wrangle_sensor_location():
+    """Wrangles sensor location dataset.
+
+    Performs wrangling and cleansing sensor location dataset.
+    Parses the location string into validated latitude and longitude, and a grid_cell_id spatial key.
+    The coordinates (and cell id) of a sensor are missing if they are invalid.
+    """
+    global df_sensor_location
+    df_sensor_location = cleanse_sensor_location(df_sensor_location)
+
+
+def cleanse_sensor_location(df):
+    """Cleanses a dataframe of sensor location.
+
+    Frame-in/frame-out version of wrangle_sensor_location, which does not depend on module globals.
+
+    Args:
+        df:
+            A dataframe of sensor location
+
+    Returns:
+        A cleansed copy of the dataframe.
+    """
+    df = df.copy()
+    # parse the "(latitude, longitude)" location string once, which also removes special characters \n in front of it
+    coordinates = df["location"].str.extract(r"\(\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\)")
+    df["location"] = "(" + coordinates[0] + ", " + coordinates[1] + ")"
+    # the coordinates are kept as parsed (float64), so the staged values are those of the location string
+    df["latitude"] = df["latitude"].astype("float64").fillna(coordinates[0].astype("float64"))
+    df["longitude"] = df["longitude"].astype("float64").fillna(coordinates[1].astype("float64"))
+
+    # validate the coordinates: they must be consistent with the location string and in the Melbourne area,
+    # otherwise they are set to missing (as is their grid cell id)
+    (min_latitude, max_latitude), (min_longitude, max_longitude) = MELBOURNE_BOUNDS
+    is_valid = (df["latitude"].between(min_latitude, max_latitude)
+                & df["longitude"].between(min_longitude, max_longitude)
+                & ((df["latitude"] - coordinates[0].astype("float64")).abs() < 1e-5)
+                & ((df["longitude"] - coordinates[1].astype("float64")).abs() < 1e-5))
+    if not is_valid.all():
+        print("sensors with invalid coordinates: {}".format(df.loc[~is_valid, "sensor_id"].tolist()))
+        df.loc[~is_valid, ["latitude", "longitude"]] = float("nan")
+
+    # compact numeric spatial key of the sensor
+    df["grid_cell_id"] = get_grid_cell_ids(df["latitude"], df["longitude"])
+    return df
+
+
+def get_grid_cell_ids(latitudes, longitudes):
+    """Returns the ids of the grid cells containing the provided coordinates.
+
+    The world is divided into a grid of cells of GRID_CELL_DEGREES, numbered row by row from the south-west corner.
+    Sensors close to each other (in the same cell) share the same id, which is a compact spatial key for joins.
+
+    Args:
+        latitudes:
+            A series of latitudes
+        longitudes:
+            A series of longitudes
+
+    Returns:
+        A series of integer (int64) grid cell ids, missing (<NA>) if a coordinate is missing.
+    """
+    cells_per_row = round(360 / GRID_CELL_DEGREES)
+    rows = (latitudes.astype("float64") + 90) // GRID_CELL_DEGREES
+    columns = (longitudes.astype("float64") + 180) // GRID_CELL_DEGREES
+    return (rows * cells_per_row + columns).astype("Int64")
+
+
+def weekday_or_weekend(row):
+    """Returns weekday or weekend value.
+
+    Checks and returns whether it is weekday or weekend, given the row containing a "day" column.
+    """
+    if "Saturday" in row["day"] or "Sunday" in row["day"]:
+        day_type = "Weekend"
+    else:
+        day_type = "Weekday"
+    return day_type
+
+
+def get_day_types(days):
+    """Returns weekday or weekend values for a column of days.
+
+    Vectorized equivalent of weekday_or_weekend for a whole column, which avoids building a row per record.
+
+    Args:
+        days:
+            A series of days in the week (Monday to Sunday)
+
+    Returns:
+        A categorical series (DAY_TYPES) whose value is Weekday or Weekend for each day.
+    """
+    is_weekend = days.isin(["Saturday", "Sunday"]).to_numpy().astype("int8")
+    return pd.Series(pd.Categorical.from_codes(is_weekend, dtype=DAY_TYPES), index=days.index)
+
+
+def get_date_keys(date_times):
+    """Returns date keys for a column of date times.
+
+    Derives the keys numerically from the parsed date times, without slicing and replacing strings.
+
+    Args:
+        date_times:
+            A series of date times (datetime64, or strings which are parsed first)
+
+    Returns:
+        A series of integer (int32) date keys following 'yyyymmdd' format.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(date_times):
+        date_times = pd.to_datetime(date_times)
+    return (date_times.dt.year * 10000 + date_times.dt.month * 100 + date_times.dt.day).astype("int32")
+
+
+def enhance_hourly_counts_data():
+    """Enhances pedestrian hourly counts dataset.
+
+    Performs wrangling, cleasing, and enhancing pedestrian hourly count dataset.
+    Creates a date_key column, which is an integer following 'yyyymmdd' format (staged as INTEGER).
+    Creates a day_type column, whose value could be weekday or weekend depending on the day in the week.
+    """
+    global df_pedestrian_per_hour
+    df_pedestrian_per_hour = enrich_hourly_counts(df_pedestrian_per_hour)
+
+
+def enrich_hourly_counts(df):
+    """Enriches a dataframe (or a chunk) of pedestrian hourly counts.
+
+    Creates the date_key and day_type columns described in enhance_hourly_counts_data.
+    Frame-in/frame-out version of enhance_hourly_counts_data, which does not depend on module globals.
+    The input dataframe is left unchanged.
+
+    Args:
+        df:
+            A dataframe of pedestrian hourly counts
+
+    Returns:
+        A new dataframe with the date_key and day_type columns added.
+    """
+    # derive date_key from existing date_time column, and create day_type flag as weekday or weekend
+    return df.assign(date_key=get_date_keys(df["date_time"]), day_type=get_day_types(df["day"]))
+
+
+def compact_hourly_counts_data(df, drop_derived_columns=False):
+    """Compacts the in-memory representation of the pedestrian hourly counts dataset.
+
+    Converts low-cardinality strings (e.g., day, month, sensor_name, day_type) into categoricals,
+    date_time into datetime64, downcasts the integer columns to their narrowest width,
+    and reports the memory used by the dataframe before and after.
+
+    Args:
+        df:
+            A dataframe of pedestrian hourly counts (e.g., after enhance_hourly_counts_data)
+        drop_derived_columns:
+            Also drop the columns that can be derived from date_time (year, month, mdate, day, time).
+            Note that the staged PEDESTRIAN_PER_HOUR table needs them for extracting statistics.
+
+    Returns:
+        A new compacted dataframe, the input dataframe is left unchanged.
+    """
+    memory_before = df.memory_usage(deep=True).sum()
+
+    if drop_derived_columns:
+        df = df.drop(columns=["year", "month", "mdate", "day", "time"])
+
+    compacted = {}
+    if not pd.api.types.is_datetime64_any_dtype(df["date_time"]):
+        compacted["date_time"] = pd.to_datetime(df["date_time"])
+    for column in df.columns.drop(list(compacted)):
+        if column in ("year", "mdate", "time", "sensor_id", "hourly_counts", "date_key", "id"):
+            compacted[column] = pd.to_numeric(df[column], downcast="integer")
+        elif pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column]):
+            if df[column].nunique() < 0.5 * df.shape[0]:  # low-cardinality strings
+                compacted[column] = df[column].astype("category")
+    df = df.assign(**compacted)
+
+    memory_after = df.memory_usage(deep=True).sum()
+    print("hourly counts memory before={:.1f}MB after={:.1f}MB".format(memory_before / 2 ** 20,
+                                                                         memory_after / 2 ** 20))
+    return df
+
+
+def stream_hourly_counts_to_stage(url, db_connection, table_name, if_exists="replace", limit=PAGE_SIZE, query=None,
+                                  checkpoint_root=None, schema=None, engine="c", cache_dir=None, adaptive=False,
+                                  landing_dir=None):
+    """Loads, enriches and stages pedestrian hourly counts chunk by chunk.
+
+    Each page flows through enrichment (see enrich_hourly_counts) and compaction, and is appended to the staged
+    table as soon as it is loaded, so the peak memory is bounded by the page size instead of the dataset size.
+    The whole dataset is never held in memory, hence it cannot be profiled in this mode.
+    Unless appended to the table, the chunks are staged into a temporary "<table_name>__staging" table which
+    replaces the table once all the chunks are staged (see replace_table), so a failed load leaves the previous
+    table intact. With a checkpoint directory, the fetched pages are also stored on disk, so a failed load can be
+    rerun without requesting the same pages again (see load_data).
+
+    Args:
+        url:
+            API endpoint
+        db_connection:
+            Connection to the sql database
+        table_name:
+            Name of the staged table
+        if_exists: {"fail", "replace", "append"}, default "replace"
+            How to behave if the table already exists (see stage_df_as_table), the following chunks are appended.
+        limit:
+            Page size (number of records) to load for each request
+        query:
+            Optional dictionary of extra query parameters (see build_endpoint), e.g., from get_delta_query
+        checkpoint_root:
+            Optional landing directory for page checkpoints (see load_data)
+        schema:
+            Optional schema of the dataset (see parse_page)
+        engine:
+            Engine parsing the pages (see load_data)
+        cache_dir:
+            Optional directory of the http cache (see load_data)
+        adaptive:
+            Adapt the page size to the latency and memory of the pages (see load_data)
+        landing_dir:
+            Optional directory of the landing zone, the chunks are also written there (see write_landing_zone)
+
+    Returns:
+        The number of records staged.
+    """
+    table_exists = db_connection.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                         (table_name,)).fetchone()[0] > 0
+    if table_exists and if_exists == "fail":
+        raise ValueError("Table '{}' already exists.".format(table_name))
+    append = table_exists and if_exists == "append"
+    target_table = table_name if append else table_name + "__staging"
+
+    checkpoint_dir = get_checkpoint_dir(checkpoint_root, url, query) if checkpoint_root else None
+    if adaptive:
+        pages = iter_pages_adaptive(url, limit, query, checkpoint_dir, schema, engine, cache_dir)
+    else:
+        pages = iter_pages(url, limit, query, checkpoint_dir, schema, engine, cache_dir)
+
+    rows = 0
+    with sqlite_profile(db_connection, "bulk_load"):  # a single bulk load for all the chunks
+        try:
+            for page in pages:
+                if page.shape[0] == 0:
+                    continue
+                if engine == "pyarrow" and pa is not None:
+                    page = arrow_to_frame(page, schema)
+                if landing_dir:
+                    write_landing_zone(page, "pedestrian_per_hour", ["year", "month"], rows > 0 or append,
+                                       landing_dir)
+                page = compact_hourly_counts_data(enrich_hourly_counts(page))
+                stage_df_as_table(page, db_connection, target_table, "append" if append or rows > 0 else "replace",
+                                  profile=None)
+                rows += page.shape[0]
+            if rows > 0 and not append:
+                replace_table(db_connection, target_table, table_name)
+                bump_table_version(db_connection, table_name)
+        except Exception:
+            if not append:
+                with db_connection:
+                    db_connection.execute('DROP TABLE IF EXISTS "{}"'.format(target_table))
+            raise
+    print("{} rows={} staged into {}".format(url, rows, table_name))
+
+    if checkpoint_dir and os.path.isdir(checkpoint_dir):  # the load is complete, checkpoints are not needed anymore
+        shutil.rmtree(checkpoint_dir)
+    return rows
+
+
+####################################################################################
+## Extract statistics
+####################################################################################
+
+#### Stats 1 and 2: Top N (most pedestrians) locations by Day or Month
+
+def calculate_stats_top_n(time_period, max_rank=None, date_range=None):
+    """Calculates top N locations (most pedestrians) by a time period (e.g., day or month).
+
+    Steps:
+    - Calculate average hourly counts by (1) time period and (2) sensor id, from the smallest rollup having the
+    columns of the time period (and the date key if filtered on a date range)
+    - Join with sensor location data to get location info
+    - Calculate the rank within each time period group based on average hourly counts
+    (rank 1 the most pedestrians), in SQL with DENSE_RANK if SQLite supports window functions, otherwise in pandas
+
+    Args:
+        time_period:
+            The required period for statistics, one of TOP_N_GRAINS: "hour" (of day), "day" (of week), "week" (ISO
+            week), "month", "year_month" (yyyymm) or "year". None for a single ranking over the whole date range.
+        max_rank:
+            Optional maximum rank (N) of the locations returned for each time period, None for all the locations
+        date_range:
+            Optional (start, end) yyyymmdd date keys (bounds included) of the hourly counts to rank on,
+            not supported with the "hour" time period (a ValueError is raised)
+
+    Returns:
+       Dataframe containing the calculated results (ranks of locations by time period)
+    """
+    if time_period is None:  # a single time period: the date range
+        time_period = "date_range"
+        expression, columns = ("'{:d}-{:d}'".format(*map(int, date_range)) if date_range else "'all'"), []
+    elif time_period in TOP_N_GRAINS:
+        expression, columns = TOP_N_GRAINS[time_period]
+    else:
+        raise ValueError("Unsupported time period {!r}, expected one of {}.".format(time_period, list(TOP_N_GRAINS)))
+
+    where = ""
+    if date_range:
+        where = "where date_key between {:d} and {:d}".format(*map(int, date_range))
+        columns = columns + ["date_key"]
+        if not any(set(columns) <= set(rollup_columns) for rollup_columns in HOURLY_COUNTS_ROLLUPS.values()):
+            raise ValueError("Time period {!r} cannot be combined with a date range: no rollup of the hourly counts "
+                             "has the columns {}.".format(time_period, columns))
+
+    # template sql query to perform the above steps
+    sql_query = '''select count_stats.*
+        , sensor.sensor_description, sensor.latitude, sensor.longitude, sensor.grid_cell_id {}
+    from 
+        ( select {} as {}, sensor_id
+            , 1.0 * SUM(sum_hourly_counts) / SUM(count_hourly_counts) as avg_hourly_counts
+        from {}
+        {}
+        group by {}, sensor_id
+        ) count_stats
+    join SENSOR on count_stats.sensor_id = sensor.sensor_id'''
+    order_by = " order by {}, avg_hourly_counts DESC".format(time_period)
+
+    if SQLITE_WINDOW_FUNCTIONS:
+        # calculate rank in SQL, only the locations up to max_rank are returned
+        rank = '''
+        , DENSE_RANK() OVER (PARTITION BY count_stats.{} ORDER BY count_stats.avg_hourly_counts DESC) as "rank"'''
+        sql_query = sql_query.format(rank.format(time_period), expression, time_period,
+                                     get_rollup_table(columns), where, expression)
+        if max_rank is not None:
+            sql_query = 'select * from ({}) ranked where "rank" <= {:d}'.format(sql_query, max_rank)
+        return query_database(staged_db, sql_query + order_by)
+
+    sql_query = sql_query.format("", expression, time_period, get_rollup_table(columns), where, expression)
+    df_top_n_locations = query_database(staged_db, sql_query + order_by)
+
+    # calculate rank using pandas (SQLite versions before 3.25 do not support window functions)
+    df_top_n_locations["rank"] = df_top_n_locations.groupby(time_period)["avg_hourly_counts"].rank("dense",
+                                                                                                   ascending=False)
+    df_top_n_locations["rank"] = df_top_n_locations["rank"].astype("int")
+    if max_rank is not None:
+        df_top_n_locations = df_top_n_locations[df_top_n_locations["rank"] <= max_rank].reset_index(drop=True)
+
+    return df_top_n_locations
+
+
+#### Stats 3: Location has shown most decline due to lockdowns
+
+def get_periods(lockdown_periods=LOCKDOWN_PERIODS):
+    """Returns the periods of the analysis (precovid, lockdown and after lockdown) as a dataframe.
+
+    Each period is a range of date keys (bounds included), with one row per lockdown period. Precovid is before
+    the first lockdown period, and after lockdown is after the last one. As date keys are yyyymmdd integers,
+    "before a date key" is the same as "up to the date key - 1" (even if the latter is not a valid date).
+
+    Args:
+        lockdown_periods:
+            Lockdown periods as (start, end) yyyymmdd strings
+
+    Returns:
+        Dataframe of the periods (period, start_date_key, end_date_key).
+    """
+    periods = [("precovid", 0, int(lockdown_periods[0][0]) - 1)]
+    periods += [("lockdown", int(start), int(end)) for (start, end) in lockdown_periods]
+    periods += [("after_lockdown", int(lockdown_periods[-1][1]) + 1, 99991231)]
+    return pd.DataFrame(periods, columns=["period", "start_date_key", "end_date_key"])
+
+
+def create_period_tables(db_connection, lockdown_periods=LOCKDOWN_PERIODS):
+    """Stages the PERIOD dimension table and the DATE_PERIOD mapping of the dates to their periods.
+
+    The mapping holds each (date key, period) pair once, even if lockdown periods overlap. It is built from the
+    dates of the daily rollup, so adding a period is only a new row in PERIOD, without any scan of the hourly counts.
+
+    Args:
+        db_connection:
+            Connection to the sql database
+        lockdown_periods:
+            Lockdown periods as (start, end) yyyymmdd strings
+    """
+    stage_df_as_table(get_periods(lockdown_periods), db_connection, "PERIOD", "replace")
+    with db_connection:
+        db_connection.execute("DROP TABLE IF EXISTS DATE_PERIOD")
+        db_connection.execute('''CREATE TABLE DATE_PERIOD AS
+            SELECT DISTINCT dates.date_key, period.period
+            FROM (SELECT DISTINCT date_key FROM {}) dates
+            JOIN PERIOD ON dates.date_key BETWEEN period.start_date_key AND period.end_date_key'''.format(
+            get_rollup_table(["date_key"])))
+    bump_table_version(db_connection, "DATE_PERIOD")
+
+
+def calculate_avg_hourly_counts_by_period(periods):
+    """Calculates average hourly counts of locations in each of the provided periods.
+
+    Steps:
+    - Calculate average hourly counts by sensor id and period, in a single grouped join of the daily rollup
+    with the mapping of the dates to their periods (see create_period_tables)
+    - Join with sensor location data to get location info
+
+    Args:
+        periods:
+            Names of the periods (e.g., "precovid", "lockdown" or "after_lockdown")
+
+    Returns:
+       Dataframe containing the calculated results (average hourly counts of locations by period)
+    """
+    sql_query = '''select count_stats.*
+        , sensor.sensor_description, sensor.latitude, sensor.longitude, sensor.grid_cell_id 
+    from 
+        ( select hourly.sensor_id, date_period.period
+            , 1.0 * SUM(hourly.sum_hourly_counts) / SUM(hourly.count_hourly_counts) as avg_hourly_counts
+        from {} hourly
+        join DATE_PERIOD date_period on hourly.date_key = date_period.date_key
+        where date_period.period in ({})
+        group by hourly.sensor_id, date_period.period
+        ) count_stats
+    join SENSOR on count_stats.sensor_id = sensor.sensor_id
+    order by sensor_id, period'''.format(get_rollup_table(["date_key"]),
+                                         ", ".join("'{}'".format(period) for period in periods))
+
+    df_avg_hourly_counts = query_database(staged_db, sql_query)
+
+    return df_avg_hourly_counts
+
+
+def get_period_avg_hourly_counts(df, period):
+    """Returns the average hourly counts of locations in a period, from the results of all periods."""
+    df = df[df["period"] == period].drop(columns="period")
+    return df.reset_index(drop=True)
+
+
+def get_difference_in_hourly_counts(df1, rename_column1, df2, rename_column2, calculated_column, percent_column):
+    """Calculates the difference in average hourly counts (e.g., between precovid and lockdown periods) for each location.
+
+    Inputs: df1 and df2 contain data (e.g., average hourly counts for locations during precovid and lockdown periods)
+    to calculate the difference
+
+    Steps:
+        - step 1: join the two dafaframe based on the location (sensor id)
+        - step 2: calculate the difference in average hourly counts as a new calculated column
+        - step 3: sort the dataframe based on the calculated difference (in descending sort)
+        - step 4: calculate the percent change (decline or growth percent)
+
+    Returns:
+        Dataframe containing the calculated results.
+    """
+    # step 1
+    df1.rename(columns={'avg_hourly_counts': rename_column1}, inplace=True)
+    df2.rename(columns={'avg_hourly_counts': rename_column2}, inplace=True)
+    df = pd.merge(left=df1, right=df2, how="inner")
+
+    # step 2
+    df[calculated_column] = df[rename_column1] - df[rename_column2]
+
+    # step 3
+    df = df.sort_values(calculated_column, ascending=False)
+
+    # step 4
+    if "growth" in percent_column:
+        df[percent_column] = (df[calculated_column] / df[rename_column2]) * 100
+    elif "decline" in percent_column:
+        df[percent_column] = (df[calculated_column] / df[rename_column1]) * 100
+
+    return df
+
+
+def get_locations_most_decline(df_avg_hourly_counts_by_period=None):
+    """Calculates the locations with most declined traffic during lockdowns (compared to precovid).
+
+    Compares the average hourly counts for each location between precovid period and during lockdown period,
+    and returns the location having most decline.
+
+    Args:
+        df_avg_hourly_counts_by_period:
+            Optional average hourly counts of locations by period (see calculate_avg_hourly_counts_by_period),
+            shared with Stats 4 so both are computed in a single query. Calculated if not provided.
+    """
+    # calculate average hourly counts during precovid and lockdown periods (6 lockdown periods in Melbourne)
+    if df_avg_hourly_counts_by_period is None:
+        df_avg_hourly_counts_by_period = calculate_avg_hourly_counts_by_period(["precovid", "lockdown"])
+    df_avg_hourly_counts_lock_down = get_period_avg_hourly_counts(df_avg_hourly_counts_by_period, "lockdown")
+    df_avg_hourly_counts_pre_covid = get_period_avg_hourly_counts(df_avg_hourly_counts_by_period, "precovid")
+
+    # calculate the most declined locations
+    df_hourly_counts_decline_lockdown = get_difference_in_hourly_counts(df_avg_hourly_counts_pre_covid,
+                                                                        "precovid_avg_hourly_counts"
+                                                                        , df_avg_hourly_counts_lock_down,
+                                                                        "lockdown_avg_hourly_counts"
+                                                                        , "declined_avg_hourly_counts",
+                                                                        "percent_decline")
+
+    return df_hourly_counts_decline_lockdown
+
+
+#### Stats 4: Location has most growth after lockdowns
+
+def get_locations_most_growth(df_avg_hourly_counts_by_period=None):
+    """Calculates the locations with most growth traffic after lockdowns.
+
+    Compares the average hourly counts for each location between lockdown period and after lockdown,
+    and returns the location having most growth.
+
+    Args:
+        df_avg_hourly_counts_by_period:
+            Optional average hourly counts of locations by period (see calculate_avg_hourly_counts_by_period),
+            shared with Stats 3 so both are computed in a single query. Calculated if not provided.
+    """
+    # calculate average hourly counts during lockdown periods and after lockdown period
+    if df_avg_hourly_counts_by_period is None:
+        df_avg_hourly_counts_by_period = calculate_avg_hourly_counts_by_period(["lockdown", "after_lockdown"])
+    df_avg_hourly_counts_lock_down = get_period_avg_hourly_counts(df_avg_hourly_counts_by_period, "lockdown")
+    df_avg_hourly_counts_after_lockdown = get_period_avg_hourly_counts(df_avg_hourly_counts_by_period,
+                                                                       "after_lockdown")
+
+    # calculate the most growth locations
+    df_hourly_counts_growth_after_lockdown = get_difference_in_hourly_counts(df_avg_hourly_counts_after_lockdown,
+                                                                             "after_lockdown_avg_hourly_counts"
+                                                                             , df_avg_hourly_counts_lock_down,
+                                                                             "lockdown_avg_hourly_counts"
+                                                                             , "growth_avg_hourly_counts",
+                                                                             "percent_growth")
+
+    return df_hourly_counts_growth_after_lockdown
+
+
+#### Stats 5: Peak hours traffic pattern analysis
+
+def calculate_avg_hourly_counts_by_day_time():
+    """Calculate average hourly by time (0-23 hours) in each day (Mon-Sun) in the week.
+
+    For each location, calculate average hourly by time (0-23 hours) in each day in the week.
+    This is useful for identifying peak hours in a day at a location.
+    """
+    sql_query = '''select count_stats.*
+        , sensor.sensor_description, sensor.latitude, sensor.longitude, sensor.grid_cell_id 
+    from 
+        ( select sensor_id, day, time, 1.0 * SUM(sum_hourly_counts) / SUM(count_hourly_counts) as avg_hourly_counts
+        from {}
+        group by sensor_id, day, time
+        ) count_stats
+    join SENSOR on count_stats.sensor_id = sensor.sensor_id '''.format(get_rollup_table(["day", "time"]))
+
+    df = query_database(staged_db, sql_query)
+
+    return df
+
+
+#### Stats 6: Weekday vs. weekend traffic analysis
+
+def calculate_avg_hourly_counts_weekday_weekend_time():
+    """Calculate average hourly by time (0-23 hours) in weekday and weekend.
+
+    For each location, calculate average hourly by time (0-23 hours) in weekday and weekend.
+    This is useful for identifying peak hours during weekday and weekend at a location.
+    """
+    sql_query = '''select count_stats.*
+        , sensor.sensor_description, sensor.latitude, sensor.longitude, sensor.grid_cell_id 
+    from 
+        ( select sensor_id, day_type, time, 1.0 * SUM(sum_hourly_counts) / SUM(count_hourly_counts) as avg_hourly_counts
+        from {}
+        group by sensor_id, day_type, time
+        ) count_stats
+    join SENSOR on count_stats.sensor_id = sensor.sensor_id '''.format(get_rollup_table(["day_type", "time"]))
+
+    df = query_database(staged_db, sql_query)
+
+    return df
+
+
+####################################################################################
+## Pipeline runner
+####################################################################################
+
+def run_hourly_counts_tasks(incremental=False, delta_query=None):
+    """Runs the hourly counts branch of the pipeline (Tasks 1.1 to 1.3, except staging).
+
+    Loads pedestrian hourly counts from API endpoint (or the landing zone), profiles and enriches them.
+    In streaming mode, the hourly counts are also staged chunk by chunk, through a connection of this branch.
+
+    Args:
+        incremental:
+            Load only the new records, which are appended to the staged table
+        delta_query:
+            Query parameters selecting the new records (see get_delta_query), None for a full load
+
+    Returns:
+        A tuple of the enriched dataframe (empty if already staged) and how to stage it ("replace" or "append").
+    """
+    stage_mode = "append" if incremental else "replace"
+
+    # Task 1.1: Load pedestrian hourly counts from API endpoint (only the new records in incremental mode)
+    # and keep them in the landing zone, or rerun from the landing zone without touching the API
+    if STREAM_HOURLY_COUNTS and not LOAD_FROM_LANDING_ZONE:
+        # Tasks 1.1 and 1.3 chunk by chunk (Task 1.2 is skipped, it needs the whole dataset)
+        # connections cannot be shared between threads
+        with contextlib.closing(connect(SQLITE_DB_FILE_NAME)) as db_connection:
+            stream_hourly_counts_to_stage(URL_PEDESTRIAN_PER_HOUR, db_connection, "PEDESTRIAN_PER_HOUR", stage_mode,
+                                          query=delta_query, checkpoint_root=CHECKPOINT_DIR,
+                                          schema=SCHEMA_PEDESTRIAN_PER_HOUR, engine=PARSER_ENGINE,
+                                          cache_dir=HTTP_CACHE_DIR, adaptive=ADAPTIVE_PAGE_SIZE,
+                                          landing_dir=LANDING_ZONE_DIR)
+        return pd.DataFrame(), stage_mode
+
+    if LOAD_FROM_LANDING_ZONE:
+        df = read_landing_zone("pedestrian_per_hour", SCHEMA_PEDESTRIAN_PER_HOUR)
+        stage_mode = "replace"
+    else:
+        df = load_data(URL_PEDESTRIAN_PER_HOUR, workers=LOAD_WORKERS, query=delta_query,
+                       checkpoint_root=CHECKPOINT_DIR, schema=SCHEMA_PEDESTRIAN_PER_HOUR, engine=PARSER_ENGINE,
+                       cache_dir=HTTP_CACHE_DIR, adaptive=ADAPTIVE_PAGE_SIZE)
+        write_landing_zone(df, "pedestrian_per_hour", ["year", "month"], append=incremental)
+
+    if df.shape[0] > 0:
+        # Task 1.2: Profile and QA hourly counts data
+        data_profiling(df, "data profiling pedestrian per hour.html")
+
+        # Task 1.3: Cleanse and enrich hourly counts dataset
+        df = compact_hourly_counts_data(enrich_hourly_counts(df))
+    return df, stage_mode
+
+
+def run_sensor_location_tasks():
+    """Runs the sensor location branch of the pipeline (Tasks 2.1 to 2.3, except staging).
+
+    Loads sensor location from API endpoint (or the landing zone), profiles and cleanses it.
+
+    Returns:
+        The cleansed dataframe of sensor location.
+    """
+    # Task 2.1: Load sensor location from API endpoint and keep it in the landing zone,
+    # or rerun from the landing zone without touching the API
+    if LOAD_FROM_LANDING_ZONE:
+        df = read_landing_zone("sensor_location", SCHEMA_SENSOR_LOCATION)
+    else:
+        df = load_data(URL_SENSOR_LOCATION, workers=LOAD_WORKERS, checkpoint_root=CHECKPOINT_DIR,
+                       schema=SCHEMA_SENSOR_LOCATION, engine=PARSER_ENGINE, cache_dir=HTTP_CACHE_DIR,
+                       adaptive=ADAPTIVE_PAGE_SIZE)
+        write_landing_zone(df, "sensor_location")
+
+    # Task 2.2: Profile and QA sensor location data
+    data_profiling(df, "data profiling sensor location.html")
+
+    # Task 2.3: Cleanse sensor location
+    return cleanse_sensor_location(df)
+
+
+def run_dataset_tasks(incremental=False, delta_query=None, parallel=True):
+    """Runs the hourly counts (Tasks 1.x) and sensor location (Tasks 2.x) branches of the pipeline.
+
+    The two branches do not depend on each other, hence they are dispatched concurrently to a pool of workers.
+
+    Args:
+        incremental:
+            Load only the new hourly counts (see run_hourly_counts_tasks)
+        delta_query:
+            Query parameters selecting the new hourly counts (see run_hourly_counts_tasks)
+        parallel:
+            Run the two branches concurrently, or one after another
+
+    Returns:
+        A tuple of the results of run_hourly_counts_tasks and run_sensor_location_tasks.
+    """
+    if not parallel:
+        return run_hourly_counts_tasks(incremental, delta_query), run_sensor_location_tasks()
+
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
+        hourly_counts_tasks = executor.submit(run_hourly_counts_tasks, incremental, delta_query)
+        sensor_location_tasks = executor.submit(run_sensor_location_tasks)
+        return hourly_counts_tasks.result(), sensor_location_tasks.result()
+
+
+####################################################################################
+## Execute the whole data pipeline
+####################################################################################
+
+if __name__ == '__main__':
+    """Automated data loading and staging pipeline.
+    
+    The data pipeline architecture described in the report provides an ideal setup for a production environment 
+    with commercial and scalable systems. 
+    In this project a Python built-in SQL database system (SQLite) was used for demonstration purpose only, 
+    and the entire data pipeline workflow was run using Python (version 3.7.1).
+    """
+    print("Automated data loading and staging - Pedestrian counting system!")
+
+    if HTTP_CACHE_DIR:
+        prune_http_cache(HTTP_CACHE_DIR)
+
+    # Tasks 1.1 to 1.3 (hourly counts) and Tasks 2.1 to 2.3 (sensor location) run concurrently
+    delta_query = get_delta_query(staged_db, "PEDESTRIAN_PER_HOUR") if INCREMENTAL_LOAD else None
+    (df_pedestrian_per_hour, stage_mode), df_sensor_location = run_dataset_tasks(INCREMENTAL_LOAD, delta_query)
+
+    # Task 1.3: Stage hourly counts dataset (append the new records in incremental mode)
+    if df_pedestrian_per_hour.shape[0] > 0:
+        stage_df_as_table(df_pedestrian_per_hour, staged_db, "PEDESTRIAN_PER_HOUR", stage_mode)
+
+    # Task 2.3: Stage sensor location into database
+    stage_df_as_table(df_sensor_location, staged_db, "SENSOR", "replace")
+
+    # Build the rollups and the indexes of the stats queries once the tables are loaded
+    create_rollups(staged_db)
+    create_period_tables(staged_db)
+    create_indexes(staged_db)
+
+    # Task 3.1: Top N locations (most traffic) by Day
+    df_top_n_locations_by_day = calculate_stats_top_n("day", TOP_N_MAX_RANK)
+    stage_df_as_table(df_top_n_locations_by_day, staged_db, "TOP_N_LOCATIONS_BY_DAY", "replace")
+
+    # Task 3.2: Top N locations (most traffic) by Month
+    df_top_n_locations_by_month = calculate_stats_top_n("month", TOP_N_MAX_RANK)
+    stage_df_as_table(df_top_n_locations_by_month, staged_db, "TOP_N_LOCATIONS_BY_MONTH", "replace")
+
+    # Task 3.2 (cont.): Top N locations (most traffic) by ISO week and by year-month, for the dashboards
+    df_top_n_locations_by_week = calculate_stats_top_n("week", TOP_N_MAX_RANK)
+    stage_df_as_table(df_top_n_locations_by_week, staged_db, "TOP_N_LOCATIONS_BY_WEEK", "replace")
+    df_top_n_locations_by_year_month = calculate_stats_top_n("year_month", TOP_N_MAX_RANK)
+    stage_df_as_table(df_top_n_locations_by_year_month, staged_db, "TOP_N_LOCATIONS_BY_YEAR_MONTH", "replace")
+
+    # Tasks 3.3 and 3.4 share the average hourly counts of the locations in all periods, computed in a single query
+    df_avg_hourly_counts_by_period = calculate_avg_hourly_counts_by_period(["precovid", "lockdown", "after_lockdown"])
+
+    # Task 3.3: Locations most decline during lockdowns
+    df_hourly_counts_decline_lockdown = get_locations_most_decline(df_avg_hourly_counts_by_period)
+    stage_df_as_table(df_hourly_counts_decline_lockdown, staged_db, "HOURLY_COUNTS_DECLINE_LOCKDOWN", "replace")
+
+    # Task 3.4: Locations most growth after lockdowns
+    df_hourly_counts_growth_after_lockdown = get_locations_most_growth(df_avg_hourly_counts_by_period)
+    stage_df_as_table(df_hourly_counts_growth_after_lockdown, staged_db, "HOURLY_COUNTS_GROWTH_AFTER_LOCKDOWN",
+                      "replace")
+
+    # Task 3.5: Peak hours traffic pattern analysis
+    df_avg_hourly_counts_by_day_time = calculate_avg_hourly_counts_by_day_time()
+    stage_df_as_table(df_avg_hourly_counts_by_day_time, staged_db, "AVG_HOURLY_COUNTS_BY_DAY_TIME", "replace")
+
+    # Task 3.6: Weekday vs. weekend traffic analysis
+    df_avg_hourly_counts_weekday_weekend_time = calculate_avg_hourly_counts_weekday_weekend_time()
+    stage_df_as_table(df_avg_hourly_counts_weekday_weekend_time, staged_db, "AVG_HOURLY_COUNTS_WEEKDAY_WEEKEND",
+                      "replace")
@@ -0,0 +1,143 @@
+"""Fixtures of the tests: the pipeline module, and a local stand-in of the Socrata API serving synthetic datasets."""
+import csv
+import datetime
+import hashlib
+import http.server
+import importlib.util
+import io
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+SCRIPT_FILE_NAME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "automated load and stage.py")
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SENSOR_IDS = (1, 2, 3, 5, 8)
+
+
+@pytest.fixture(scope="session")
+def pipeline(tmp_path_factory):
+    """The pipeline module, imported from a temporary working directory (it connects to the staging database)."""
+    try:
+        import pandas_profiling  # noqa: F401, required by the pipeline module
+    except ImportError as error:
+        pytest.skip("pandas_profiling cannot be imported: {}".format(error))
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("pipeline"))
+    try:
+        spec = importlib.util.spec_from_file_location("pipeline", SCRIPT_FILE_NAME)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+def make_hourly_counts(n_days, start=datetime.datetime(2020, 3, 1)):
+    """Synthetic hourly counts of the sensors, as a CSV header and rows."""
+    rnd = random.Random(1)
+    rows = []
+    for day in range(n_days):
+        for hour in range(24):
+            date_time = start + datetime.timedelta(days=day, hours=hour)
+            for sensor_id in SENSOR_IDS:
+                rows.append([len(rows) + 1, date_time.strftime("%Y-%m-%dT%H:%M:%S.000"), date_time.year,
+                             date_time.strftime("%B"), date_time.day, DAYS_OF_WEEK[date_time.weekday()], hour,
+                             sensor_id, "Sensor {}".format(sensor_id), rnd.randint(0, 3000)])
+    header = ["id", "date_time", "year", "month", "mdate", "day", "time", "sensor_id", "sensor_name", "hourly_counts"]
+    return header, rows
+
+
+def make_sensor_locations():
+    """Synthetic sensor locations, as a CSV header and rows."""
+    rows = []
+    for sensor_id in SENSOR_IDS:
+        latitude, longitude = round(-37.81 + sensor_id * 0.001, 6), round(144.96 + sensor_id * 0.001, 6)
+        rows.append([sensor_id, "Description {}".format(sensor_id), "S{}".format(sensor_id), "2009-03-30T00:00:00.000",
+                     "A", "", "North", "South", latitude, longitude, "\n    ({}, {})".format(latitude, longitude)])
+    header = ["sensor_id", "sensor_description", "sensor_name", "installation_date", "status", "note", "direction_1",
+              "direction_2", "latitude", "longitude", "location"]
+    return header, rows
+
+
+class StandInApi(http.server.ThreadingHTTPServer):
+    """Local stand-in of the Socrata API: paging ($limit, $offset), $where "column > value", $order, $select
+    (including count(*)), and ETag validators answered with 304 not modified (unless etag is False).
+    The page size can be capped (max_limit), and pages larger than slow_limit answered after slow_seconds."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInApiHandler)
+        self.datasets = {"/hourly.csv": make_hourly_counts(30), "/sensor.csv": make_sensor_locations()}
+        self.requests = []  # (path, query) of the requests received
+        self.etag = True
+        self.rows_added_after_count = {}  # rows appended to a dataset once it is counted, by path
+        self.max_limit = None
+        self.slow_limit = None
+        self.slow_seconds = 0.5
+        self.url = "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def handle_error(self, request, client_address):
+        pass  # e.g., a client which timed out before its (slow) page was sent
+
+
+class StandInApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        self.server.requests.append((url.path, query))
+        header, rows = self.server.datasets[url.path]
+        if "$where" in query:
+            column, _, value = query["$where"].split(" ")
+            rows = [row for row in rows if row[header.index(column)] > int(value)]
+        if "$order" in query:
+            rows = sorted(rows, key=lambda row: row[header.index(query["$order"].split(" ")[0])])
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if query.get("$select") == "count(*)":
+            writer.writerows([["count"], [len(rows)]])
+            self.server.datasets[url.path][1].extend(self.server.rows_added_after_count.pop(url.path, []))
+        else:
+            columns = query["$select"].split(",") if "$select" in query else header
+            offset, limit = int(query.get("$offset", 0)), int(query.get("$limit", 1000))
+            if self.server.slow_limit is not None and limit > self.server.slow_limit:
+                time.sleep(self.server.slow_seconds)
+            limit = min(limit, self.server.max_limit or limit)
+            writer.writerow(columns)
+            writer.writerows([[row[header.index(column)] for column in columns] for row in rows[offset:offset + limit]])
+        body = buffer.getvalue().encode()
+
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if self.server.etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        if self.server.etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def api():
+    """A running local stand-in of the Socrata API."""
+    server = StandInApi()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
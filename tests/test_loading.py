@@ -0,0 +1,205 @@
+"""Tests of the loading of the datasets from the (stand-in) API endpoints."""
+import asyncio
+import hashlib
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from conftest import make_hourly_counts
+
+
+def test_concurrent_load_equals_sequential_load(pipeline, api):
+    url = api.url + "/hourly.csv"
+    df_sequential = pipeline.load_data(url, limit=1000, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR)
+    api.requests.clear()
+    df_concurrent = pipeline.load_data(url, limit=1000, workers=4, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR)
+
+    pd.testing.assert_frame_equal(df_concurrent, df_sequential)
+    assert df_concurrent.shape[0] == 30 * 24 * 5
+    # the first page, the count probe, and the remaining pages only: no page requested beyond the end of the table
+    assert len(api.requests) == 1 + 1 + (df_concurrent.shape[0] - 1) // 1000
+
+
+def test_concurrent_load_of_records_added_after_the_count(pipeline, api):
+    url = api.url + "/hourly.csv"
+    _, rows = make_hourly_counts(31)
+    api.rows_added_after_count["/hourly.csv"] = rows[30 * 24 * 5:30 * 24 * 5 + 10]
+    df_concurrent = pipeline.load_data(url, limit=1200, workers=4, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR)
+    df_sequential = pipeline.load_data(url, limit=1200, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR)
+
+    assert df_sequential.shape[0] == 30 * 24 * 5 + 10
+    pd.testing.assert_frame_equal(df_concurrent, df_sequential)
+
+
+def test_concurrent_load_of_a_single_page_table(pipeline, api):
+    df = pipeline.load_data(api.url + "/sensor.csv", limit=1000, workers=4)
+
+    assert df.shape[0] == 5
+    assert len(api.requests) == 1
+
+
+def test_http_cache_miss_then_revalidated(pipeline, api, tmp_path):
+    endpoint = pipeline.build_endpoint(api.url + "/hourly.csv", 100, 0)
+    body, source = pipeline.fetch_page_cached(endpoint, str(tmp_path))
+    assert source == "api"
+
+    cached_body, source = pipeline.fetch_page_cached(endpoint, str(tmp_path))
+    assert source == "revalidated"
+    assert cached_body == body
+    assert api.requests[-1][0] == "/hourly.csv"  # revalidated with a conditional request
+
+
+def test_http_cache_hit_without_validators(pipeline, api, tmp_path):
+    api.etag = False
+    endpoint = pipeline.build_endpoint(api.url + "/hourly.csv", 100, 0)
+    body, source = pipeline.fetch_page_cached(endpoint, str(tmp_path))
+    assert source == "api"
+
+    cached_body, source = pipeline.fetch_page_cached(endpoint, str(tmp_path))
+    assert source == "cache"
+    assert cached_body == body
+    assert len(api.requests) == 1
+
+    _, source = pipeline.fetch_page_cached(endpoint, str(tmp_path), ttl=0)  # expired
+    assert source == "api"
+
+
+def test_http_cache_ignores_a_truncated_body(pipeline, api, tmp_path):
+    endpoint = pipeline.build_endpoint(api.url + "/hourly.csv", 100, 0)
+    body, _ = pipeline.fetch_page_cached(endpoint, str(tmp_path))
+    body_file = next(tmp_path.glob("*.csv"))
+    body_file.write_bytes(body[:len(body) // 2])  # e.g., an interrupted write
+
+    refetched_body, source = pipeline.fetch_page_cached(endpoint, str(tmp_path))
+    assert source == "api"
+    assert refetched_body == body
+
+
+def test_load_data_through_http_cache(pipeline, api, tmp_path, capsys):
+    url = api.url + "/sensor.csv"
+    df = pipeline.load_data(url, limit=1000, cache_dir=str(tmp_path))
+    assert "source=api" in capsys.readouterr().out
+
+    cached_df = pipeline.load_data(url, limit=1000, cache_dir=str(tmp_path))
+    assert "source=revalidated" in capsys.readouterr().out
+    pd.testing.assert_frame_equal(cached_df, df)
+
+
+def assert_same_records(df, expected):
+    """The index of a loaded dataframe is the position of the records within their page, which depends on the
+    page sizes."""
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def get_requested_pages(api):
+    return [(int(query["$offset"]), int(query["$limit"])) for _, query in api.requests]
+
+
+@pytest.fixture
+def small_pages(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "PAGE_SIZE_MIN", 100)
+    monkeypatch.setattr(pipeline, "PAGE_TIMEOUT_SECONDS", 0.2)
+
+
+def test_adaptive_page_size_grows(pipeline, api, small_pages):
+    url = api.url + "/hourly.csv"
+    df = pipeline.load_data(url, limit=100, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR, adaptive=True)
+
+    assert get_requested_pages(api) == [(0, 100), (100, 200), (300, 400), (700, 800), (1500, 1600), (3100, 3200),
+                                        (3600, 500)]
+    assert_same_records(df, pipeline.load_data(url, limit=1000, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR))
+
+
+def test_adaptive_page_size_shrinks_on_timeout(pipeline, api, small_pages):
+    api.slow_limit = 1000
+    url = api.url + "/hourly.csv"
+    df = pipeline.load_data(url, limit=1600, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR, adaptive=True)
+
+    pages = get_requested_pages(api)
+    assert pages[:2] == [(0, 1600), (0, 800)]  # timed out, then retried with half of the page size
+    assert df.shape[0] == 30 * 24 * 5
+    assert_same_records(df, pipeline.load_data(url, limit=1000, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR))
+
+
+def test_adaptive_page_size_capped_by_the_api(pipeline, api, small_pages):
+    api.max_limit = 500
+    url = api.url + "/hourly.csv"
+    df = pipeline.load_data(url, limit=400, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR, adaptive=True)
+
+    assert get_requested_pages(api)[:3] == [(0, 400), (400, 800), (900, 500)]  # a short page caps the page size
+    assert get_requested_pages(api)[-2:] == [(3400, 500), (3600, 200)]  # the first empty page is the end
+    assert df.shape[0] == 30 * 24 * 5
+    assert_same_records(df, pipeline.load_data(url, limit=500, schema=pipeline.SCHEMA_PEDESTRIAN_PER_HOUR))
+
+
+def test_async_load_equals_load_data(pipeline, api):
+    pytest.importorskip("aiohttp")
+    urls = [api.url + "/hourly.csv", api.url + "/sensor.csv"]
+    schemas = [pipeline.SCHEMA_PEDESTRIAN_PER_HOUR, pipeline.SCHEMA_SENSOR_LOCATION]
+    dfs = asyncio.run(pipeline.load_data_async(urls, limit=1000, schemas=schemas))
+
+    # 4 pages of hourly counts and a single page of sensor locations: no page requested after the last one
+    assert sorted(get_requested_pages(api)) == [(0, 1000), (0, 1000), (1000, 1000), (2000, 1000), (3000, 1000)]
+    for df, url, schema in zip(dfs, urls, schemas):
+        assert_same_records(df, pipeline.load_data(url, limit=1000, schema=schema))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_interrupted_load_resumes_from_checkpoints(pipeline, api, tmp_path, monkeypatch, workers):
+    url = api.url + "/hourly.csv"
+    schema = pipeline.SCHEMA_PEDESTRIAN_PER_HOUR
+    checkpoint_root = str(tmp_path / "checkpoints")
+    fetch_page = pipeline.fetch_page
+
+    def fetch_page_until_offset_2000(endpoint, timeout=None):  # e.g., the connection is lost
+        if "$offset=2000" in endpoint:
+            raise OSError("connection reset")
+        return fetch_page(endpoint, timeout)
+
+    monkeypatch.setattr(pipeline, "fetch_page", fetch_page_until_offset_2000)
+    with pytest.raises(OSError):
+        pipeline.load_data(url, limit=1000, workers=workers, checkpoint_root=checkpoint_root, schema=schema)
+
+    monkeypatch.setattr(pipeline, "fetch_page", fetch_page)
+    api.requests.clear()
+    df = pipeline.load_data(url, limit=1000, workers=workers, checkpoint_root=checkpoint_root, schema=schema)
+
+    offsets = {query.get("$offset") for _, query in api.requests}
+    assert "0" not in offsets and "1000" not in offsets  # loaded from their checkpoints
+    assert_same_records(df, pipeline.load_data(url, limit=1000, schema=schema))
+    assert os.listdir(checkpoint_root) == []  # removed once the load is complete
+
+
+def test_landing_zone_round_trip(pipeline, api, tmp_path):
+    landing_dir = str(tmp_path / "landing")
+    schema = pipeline.SCHEMA_PEDESTRIAN_PER_HOUR
+    df = pipeline.load_data(api.url + "/hourly.csv", schema=schema)
+    pipeline.write_landing_zone(df.iloc[:2000], "pedestrian_per_hour", ["year", "month"], landing_dir=landing_dir)
+    pipeline.write_landing_zone(df.iloc[2000:], "pedestrian_per_hour", ["year", "month"], append=True,
+                                landing_dir=landing_dir)  # e.g., the new records of an incremental load
+
+    landed = pipeline.read_landing_zone("pedestrian_per_hour", schema, landing_dir)
+    landed = landed.sort_values("id")[df.columns]  # read partition by partition
+    assert_same_records(landed, df)
+
+    sensor_schema = pipeline.SCHEMA_SENSOR_LOCATION
+    df = pipeline.load_data(api.url + "/sensor.csv", schema=sensor_schema)
+    pipeline.write_landing_zone(df, "sensor_location", landing_dir=landing_dir)
+    assert_same_records(pipeline.read_landing_zone("sensor_location", sensor_schema, landing_dir), df)
+
+
+def test_http_cache_prunes_the_pages_unused_for_the_ttl(pipeline, api, tmp_path):
+    endpoints = [pipeline.build_endpoint(api.url + "/hourly.csv", 100, offset) for offset in (0, 100)]
+    for endpoint in endpoints:
+        pipeline.fetch_page_cached(endpoint, str(tmp_path))
+    old_key = hashlib.sha1(endpoints[0].encode()).hexdigest()
+    a_day_ago = time.time() - 24 * 60 * 60
+    os.utime(str(tmp_path / (old_key + ".json")), (a_day_ago, a_day_ago))
+
+    assert pipeline.prune_http_cache(str(tmp_path), ttl=60 * 60) == 1
+    assert sorted(f.name for f in tmp_path.iterdir()) == sorted(
+        hashlib.sha1(endpoints[1].encode()).hexdigest() + extension for extension in (".csv", ".json"))
+    _, source = pipeline.fetch_page_cached(endpoints[1], str(tmp_path))
+    assert source == "revalidated"
@@ -0,0 +1,76 @@
+"""Tests of the cache of the query results."""
+import collections
+import os
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def db_connection(pipeline, tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "query_cache", collections.OrderedDict())
+    connection = pipeline.connect(str(tmp_path / "staged.db"))
+    pipeline.stage_df_as_table(pd.DataFrame({"id": range(100), "name": ["name {}".format(i) for i in range(100)]}),
+                               connection, "NAMES", "replace")
+    yield connection
+    connection.close()
+
+
+def test_query_cache_settings_are_read_when_querying(pipeline, db_connection, tmp_path, monkeypatch, capsys):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(pipeline, "QUERY_CACHE_DIR", str(tmp_path / "query_cache"))
+    df = pipeline.query_database(db_connection, "SELECT * FROM NAMES")
+    assert len(os.listdir(str(tmp_path / "query_cache"))) == 1
+
+    pipeline.query_cache.clear()
+    cached_df = pipeline.query_database(db_connection, "SELECT * FROM NAMES")
+    assert "source=parquet" in capsys.readouterr().out
+    pd.testing.assert_frame_equal(cached_df, df)
+
+    monkeypatch.setattr(pipeline, "QUERY_CACHE", False)
+    pipeline.query_database(db_connection, "SELECT * FROM NAMES")
+    assert "source=" not in capsys.readouterr().out
+
+
+def test_query_cache_files_are_pruned_beyond_the_size_cap(pipeline, db_connection, tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    cache_dir = tmp_path / "query_cache"
+    monkeypatch.setattr(pipeline, "QUERY_CACHE_DIR", str(cache_dir))
+    pipeline.query_database(db_connection, "SELECT * FROM NAMES WHERE id < 10")
+    file_bytes = sum(f.stat().st_size for f in cache_dir.iterdir())
+
+    monkeypatch.setattr(pipeline, "QUERY_CACHE_MAX_BYTES", int(2.5 * file_bytes))
+    for i in range(20, 60, 10):
+        pipeline.query_database(db_connection, "SELECT * FROM NAMES WHERE id < {}".format(i))
+        assert sum(f.stat().st_size for f in cache_dir.iterdir()) <= pipeline.QUERY_CACHE_MAX_BYTES
+    assert 1 <= len(list(cache_dir.iterdir())) < 5
+
+
+def test_restaging_a_table_invalidates_its_cached_results(pipeline, db_connection, capsys):
+    df = pipeline.query_database(db_connection, "SELECT count(*) AS n FROM NAMES")
+    assert df["n"][0] == 100
+    pipeline.query_database(db_connection, "SELECT count(*) AS n\n  FROM NAMES")  # the same normalized SQL
+    assert capsys.readouterr().out.count("source=cache") == 1
+
+    key = pipeline.get_query_cache_key(db_connection, "SELECT count(*) AS n FROM NAMES")
+    pipeline.stage_df_as_table(pd.DataFrame({"id": range(10), "name": "name"}), db_connection, "NAMES", "replace")
+    assert pipeline.get_query_cache_key(db_connection, "SELECT count(*) AS n FROM NAMES") != key
+
+    df = pipeline.query_database(db_connection, "SELECT count(*) AS n FROM NAMES")
+    assert df["n"][0] == 10
+    assert "source=cache" not in capsys.readouterr().out
+
+
+def test_least_recently_used_results_are_evicted_beyond_the_memory_cap(pipeline, db_connection, monkeypatch):
+    queries = ["SELECT * FROM NAMES WHERE id < {}".format(n) for n in (10, 20, 30)]
+    keys = [pipeline.get_query_cache_key(db_connection, sql_query) for sql_query in queries]
+    df = pipeline.query_database(db_connection, queries[0])
+    memory = df.memory_usage(index=True, deep=True).sum()
+    monkeypatch.setattr(pipeline, "QUERY_CACHE_MAX_BYTES", int(4.5 * memory))  # about two results of 10 and 20 rows
+
+    pipeline.query_database(db_connection, queries[1])
+    assert list(pipeline.query_cache) == keys[:2]
+    pipeline.query_database(db_connection, queries[0])  # most recently used
+    pipeline.query_database(db_connection, queries[2])
+    assert list(pipeline.query_cache) == [keys[0], keys[2]]
+    assert sum(memory for (_, memory) in pipeline.query_cache.values()) <= pipeline.QUERY_CACHE_MAX_BYTES
@@ -0,0 +1,138 @@
+"""Tests of the staging of the dataframes into the SQLite staging database."""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def db_connection(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "staged.db"))
+    yield connection
+    connection.close()
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_dates_are_staged_with_the_source_iso_format(pipeline, db_connection, bulk):
+    df = pd.DataFrame({"id": [1, 2], "date_time": pd.to_datetime(["2019-11-01T17:00:00.000", None])})
+    pipeline.stage_df_as_table(df, db_connection, "DATES", "replace", bulk=bulk)
+
+    rows = db_connection.execute('SELECT date_time FROM "DATES" ORDER BY id').fetchall()
+    assert rows == [("2019-11-01T17:00:00.000",), (None,)]
+
+
+def test_bulk_replace_keeps_the_previous_table_if_the_load_fails(pipeline, db_connection):
+    pipeline.stage_df_as_table(pd.DataFrame({"id": [1, 2, 3], "name": ["a", "b", "c"]}), db_connection, "NAMES")
+
+    failing_df = pd.DataFrame({"id": [4, 5, 6], "name": ["d", "e", {"not": "bindable"}]})
+    with pytest.raises(sqlite3.Error):
+        pipeline.bulk_stage_df_as_table(failing_df, db_connection, "NAMES", "replace", batch_size=2)
+
+    rows = db_connection.execute('SELECT id, name FROM "NAMES" ORDER BY id').fetchall()
+    assert rows == [(1, "a"), (2, "b"), (3, "c")]
+    tables = db_connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    assert ("NAMES__staging",) not in tables
+
+
+@pytest.mark.parametrize("if_exists", ["replace", "append"])
+def test_bulk_staging_in_batches(pipeline, db_connection, if_exists):
+    pipeline.stage_df_as_table(pd.DataFrame({"id": [1, 2, 3]}), db_connection, "IDS")
+    pipeline.bulk_stage_df_as_table(pd.DataFrame({"id": range(10, 15)}), db_connection, "IDS", if_exists, batch_size=2)
+
+    ids = [row[0] for row in db_connection.execute('SELECT id FROM "IDS" ORDER BY id')]
+    assert ids == ([1, 2, 3] if if_exists == "append" else []) + [10, 11, 12, 13, 14]
+
+
+def test_serving_profile_is_kept_by_queries_and_restored_after_bulk_loads(pipeline, tmp_path):
+    db_connection = pipeline.connect(str(tmp_path / "serving.db"))
+    serving_cache_size = pipeline.SQLITE_PROFILES["serving"]["cache_size"]
+    assert db_connection.execute("PRAGMA cache_size").fetchone()[0] == serving_cache_size
+
+    db_connection.execute("CREATE TABLE IDS (id INTEGER)")
+    pipeline.query_database(db_connection, "SELECT * FROM IDS", cache=False)
+    assert db_connection.execute("PRAGMA journal_mode").fetchone()[0] == "delete"  # not switched by reads
+
+    pipeline.stage_df_as_table(pd.DataFrame({"id": [1, 2]}), db_connection, "IDS", "replace")
+    assert db_connection.execute("PRAGMA cache_size").fetchone()[0] == serving_cache_size
+    db_connection.close()
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_staging_into_an_in_memory_database(pipeline, bulk):
+    db_connection = sqlite3.connect(":memory:")
+    pipeline.stage_df_as_table(pd.DataFrame({"a": [1, 2]}), db_connection, "A", "replace", bulk=bulk)
+    assert db_connection.execute('SELECT a FROM "A" ORDER BY a').fetchall() == [(1,), (2,)]
+    db_connection.close()
+
+
+def read_table(db_connection, table_name):
+    return pd.read_sql('SELECT * FROM "{}" ORDER BY id'.format(table_name), db_connection)
+
+
+def test_streamed_hourly_counts_equal_the_staged_loaded_hourly_counts(pipeline, api, db_connection):
+    url = api.url + "/hourly.csv"
+    schema = pipeline.SCHEMA_PEDESTRIAN_PER_HOUR
+    df = pipeline.load_data(url, limit=1000, schema=schema)
+    df = pipeline.compact_hourly_counts_data(pipeline.enrich_hourly_counts(df))
+    pipeline.stage_df_as_table(df, db_connection, "LOADED", "replace")
+
+    rows = pipeline.stream_hourly_counts_to_stage(url, db_connection, "STREAMED", limit=1000, schema=schema)
+    assert rows == df.shape[0]
+    pd.testing.assert_frame_equal(read_table(db_connection, "STREAMED"), read_table(db_connection, "LOADED"))
+
+
+def test_failed_stream_keeps_the_previous_table_and_resumes_from_checkpoints(pipeline, api, db_connection, tmp_path,
+                                                                           monkeypatch):
+    url = api.url + "/hourly.csv"
+    schema = pipeline.SCHEMA_PEDESTRIAN_PER_HOUR
+    pipeline.stage_df_as_table(pd.DataFrame({"id": [1, 2, 3]}), db_connection, "STREAMED")
+
+    enrich_hourly_counts = pipeline.enrich_hourly_counts
+    calls = []
+
+    def enrich_two_chunks(df):  # e.g., a network error while loading the third page
+        calls.append(df.shape[0])
+        if len(calls) > 2:
+            raise OSError("connection reset")
+        return enrich_hourly_counts(df)
+
+    monkeypatch.setattr(pipeline, "enrich_hourly_counts", enrich_two_chunks)
+    with pytest.raises(OSError):
+        pipeline.stream_hourly_counts_to_stage(url, db_connection, "STREAMED", limit=1000, schema=schema,
+                                               checkpoint_root=str(tmp_path / "checkpoints"))
+    assert read_table(db_connection, "STREAMED")["id"].tolist() == [1, 2, 3]
+    tables = db_connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    assert ("STREAMED__staging",) not in tables
+
+    monkeypatch.setattr(pipeline, "enrich_hourly_counts", enrich_hourly_counts)
+    api.requests.clear()
+    rows = pipeline.stream_hourly_counts_to_stage(url, db_connection, "STREAMED", limit=1000, schema=schema,
+                                                  checkpoint_root=str(tmp_path / "checkpoints"))
+    assert rows == 30 * 24 * 5
+    assert read_table(db_connection, "STREAMED").shape[0] == rows
+    assert [query["$offset"] for _, query in api.requests] == ["3000"]  # the first three pages are checkpointed
+    assert not (tmp_path / "checkpoints").exists() or not any((tmp_path / "checkpoints").iterdir())
+
+
+def test_incremental_load_appends_the_records_beyond_the_high_water_mark(pipeline, api, db_connection):
+    url = api.url + "/hourly.csv"
+    schema = pipeline.SCHEMA_PEDESTRIAN_PER_HOUR
+    df = pipeline.compact_hourly_counts_data(pipeline.enrich_hourly_counts(pipeline.load_data(url, schema=schema)))
+    pipeline.stage_df_as_table(df, db_connection, "LOADED", "replace")
+    pipeline.stage_df_as_table(df.iloc[:2000], db_connection, "PEDESTRIAN_PER_HOUR", "replace")
+    pipeline.create_indexes(db_connection, {"PEDESTRIAN_PER_HOUR": pipeline.STATS_INDEXES["PEDESTRIAN_PER_HOUR"]})
+
+    query = pipeline.get_delta_query(db_connection, "PEDESTRIAN_PER_HOUR")
+    assert query == {"$where": "id > 2000", "$order": "id"}
+    indexes, full_scans = pipeline.check_query_plan(db_connection, "select max(id) from PEDESTRIAN_PER_HOUR")
+    assert (indexes, full_scans) == (["ix_PEDESTRIAN_PER_HOUR_id"], [])
+
+    api.requests.clear()
+    delta = pipeline.load_data(url, limit=1000, query=query, schema=schema)
+    assert [request["$where"] for _, request in api.requests] == ["id > 2000"] * 2
+    assert delta["id"].tolist() == list(range(2001, 3601))
+
+    delta = pipeline.compact_hourly_counts_data(pipeline.enrich_hourly_counts(delta))
+    pipeline.stage_df_as_table(delta, db_connection, "PEDESTRIAN_PER_HOUR", "append")
+    pd.testing.assert_frame_equal(read_table(db_connection, "PEDESTRIAN_PER_HOUR"), read_table(db_connection, "LOADED"))
+    assert pipeline.get_delta_query(db_connection, "PEDESTRIAN_PER_HOUR") == {"$where": "id > 3600", "$order": "id"}
@@ -0,0 +1,119 @@
+"""Tests of the statistics queried from the staging database."""
+import datetime
+
+import pandas as pd
+import pytest
+
+from conftest import SENSOR_IDS, make_hourly_counts, make_sensor_locations
+
+
+@pytest.fixture(scope="module")
+def stats_db_connection(pipeline, tmp_path_factory):
+    """A staging database of synthetic datasets (before, during and after the lockdowns), with its rollups and
+    indexes."""
+    db_connection = pipeline.connect(str(tmp_path_factory.mktemp("stats") / "stats.db"))
+    header, rows = make_hourly_counts(800, start=datetime.datetime(2019, 12, 1))
+    df = pd.DataFrame(rows, columns=header).assign(date_time=lambda df: pd.to_datetime(df["date_time"]))
+    pipeline.stage_df_as_table(pipeline.compact_hourly_counts_data(pipeline.enrich_hourly_counts(df)), db_connection,
+                               "PEDESTRIAN_PER_HOUR", "replace")
+    header, rows = make_sensor_locations()
+    pipeline.stage_df_as_table(pipeline.cleanse_sensor_location(pd.DataFrame(rows, columns=header)), db_connection,
+                               "SENSOR", "replace")
+    pipeline.create_rollups(db_connection)
+    pipeline.create_period_tables(db_connection)
+    pipeline.create_indexes(db_connection)
+    yield db_connection
+    db_connection.close()
+
+
+@pytest.fixture
+def stats_db(pipeline, stats_db_connection, monkeypatch):
+    """The synthetic staging database, used by the stats instead of the staging database of the pipeline."""
+    monkeypatch.setattr(pipeline, "staged_db", stats_db_connection)
+    return stats_db_connection
+
+
+def get_query_plan_indexes(pipeline, monkeypatch, stats):
+    """Runs the stats, and returns the set of indexes used by each of their queries."""
+    queries = []
+    query_database = pipeline.query_database
+
+    def record_query(db_connection, sql_query, **kwargs):
+        queries.append(sql_query)
+        return query_database(db_connection, sql_query, **kwargs)
+
+    monkeypatch.setattr(pipeline, "query_database", record_query)
+    stats()
+    return [set(pipeline.check_query_plan(pipeline.staged_db, sql_query)[0]) for sql_query in queries]
+
+
+def test_top_n_locations_by_month_uses_its_covering_index(pipeline, stats_db, monkeypatch):
+    indexes = get_query_plan_indexes(pipeline, monkeypatch, lambda: pipeline.calculate_stats_top_n("month"))
+    assert indexes == [{"ix_ROLLUP_BY_DATE_sensor_id_month_sum_hourly_counts_count_hourly_counts",
+                        "ix_SENSOR_sensor_id"}]
+
+
+def test_avg_hourly_counts_by_period_use_their_indexes(pipeline, stats_db, monkeypatch):
+    indexes = get_query_plan_indexes(pipeline, monkeypatch, lambda: pipeline.calculate_avg_hourly_counts_by_period(
+        ["precovid", "lockdown", "after_lockdown"]))
+    assert indexes == [{"ix_DATE_PERIOD_date_key_period",
+                        "ix_ROLLUP_BY_DATE_sensor_id_date_key_sum_hourly_counts_count_hourly_counts",
+                        "ix_SENSOR_sensor_id"}]
+
+
+@pytest.mark.parametrize("stats", ["calculate_avg_hourly_counts_by_day_time",
+                                   "calculate_avg_hourly_counts_weekday_weekend_time"])
+def test_avg_hourly_counts_by_time_join_sensors_by_index(pipeline, stats_db, monkeypatch, stats):
+    indexes = get_query_plan_indexes(pipeline, monkeypatch, getattr(pipeline, stats))
+    assert indexes == [{"ix_SENSOR_sensor_id"}]
+
+
+@pytest.mark.parametrize("time_period", [None, "day", "week", "month", "year_month", "year"])
+def test_top_n_locations_within_a_date_range(pipeline, stats_db, time_period):
+    df = pipeline.calculate_stats_top_n(time_period, max_rank=2, date_range=("20200401", "20200430"))
+    assert not df.empty
+    assert df["rank"].max() <= 2
+
+
+def test_top_n_locations_by_hour_within_a_date_range_is_rejected(pipeline, stats_db):
+    with pytest.raises(ValueError, match="cannot be combined with a date range"):
+        pipeline.calculate_stats_top_n("hour", date_range=("20200401", "20200430"))
+
+
+@pytest.mark.parametrize("columns", [["day"], ["month"], ["day", "time"], ["day_type", "time"]])
+def test_rollup_averages_equal_the_averages_of_the_hourly_counts(pipeline, stats_db, columns):
+    group_by = ", ".join(["sensor_id"] + columns)
+    expected = pd.read_sql("select {0}, AVG(hourly_counts) as avg_hourly_counts from PEDESTRIAN_PER_HOUR "
+                           "group by {0} order by {0}".format(group_by), stats_db)
+    df = pd.read_sql("select {0}, 1.0 * SUM(sum_hourly_counts) / SUM(count_hourly_counts) as avg_hourly_counts "
+                     "from {1} group by {0} order by {0}".format(group_by, pipeline.get_rollup_table(columns)),
+                     stats_db)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_avg_hourly_counts_by_period_equal_the_filters_of_the_lockdown_periods(pipeline, stats_db):
+    # the filters of each period as date ranges chained with OR (the overlapping lockdowns of 2021 included)
+    lockdown_periods = pipeline.LOCKDOWN_PERIODS
+    filters = {
+        "precovid": "date_key < {}".format(lockdown_periods[0][0]),
+        "lockdown": " or ".join("(date_key between {} and {})".format(start, end) for start, end in lockdown_periods),
+        "after_lockdown": "date_key > {}".format(lockdown_periods[-1][1]),
+    }
+    df = pipeline.calculate_avg_hourly_counts_by_period(list(filters))
+
+    for period, filter_condition in filters.items():
+        expected = pd.read_sql("select sensor_id, AVG(hourly_counts) as avg_hourly_counts from PEDESTRIAN_PER_HOUR "
+                               "where {} group by sensor_id order by sensor_id".format(filter_condition), stats_db)
+        period_df = pipeline.get_period_avg_hourly_counts(df, period)[["sensor_id", "avg_hourly_counts"]]
+        pd.testing.assert_frame_equal(period_df, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("max_rank", [None, 2])
+@pytest.mark.parametrize("time_period", ["day", "month"])
+def test_top_n_locations_ranked_in_pandas_equal_dense_rank(pipeline, stats_db, monkeypatch, time_period, max_rank):
+    expected = pipeline.calculate_stats_top_n(time_period, max_rank)
+    monkeypatch.setattr(pipeline, "SQLITE_WINDOW_FUNCTIONS", False)  # SQLite versions before 3.25
+    df = pipeline.calculate_stats_top_n(time_period, max_rank)
+
+    pd.testing.assert_frame_equal(df, expected)
+    assert df["rank"].max() == (max_rank or len(SENSOR_IDS))
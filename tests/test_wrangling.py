@@ -0,0 +1,63 @@
+"""Tests of the wrangling of the pedestrian hourly counts."""
+import pandas as pd
+
+from conftest import DAYS_OF_WEEK, make_hourly_counts, make_sensor_locations
+
+
+def test_day_types_equal_weekday_or_weekend(pipeline):
+    df = pd.DataFrame({"day": DAYS_OF_WEEK * 2}, index=range(10, 24))
+    expected = df.apply(pipeline.weekday_or_weekend, axis=1)
+
+    day_types = pipeline.get_day_types(df["day"])
+    assert day_types.astype(str).tolist() == expected.tolist()
+    assert day_types.index.equals(df.index)
+    assert day_types.value_counts().to_dict() == {"Weekday": 10, "Weekend": 4}
+
+
+def test_enrich_hourly_counts_leaves_its_input_unchanged(pipeline):
+    df = pd.DataFrame({"date_time": pd.to_datetime(["2020-03-01T10:00:00", "2020-03-02T11:00:00"]),
+                       "day": ["Sunday", "Monday"]})
+    original = df.copy()
+
+    enriched = pipeline.enrich_hourly_counts(df)
+    pd.testing.assert_frame_equal(df, original)
+    assert enriched["date_key"].tolist() == [20200301, 20200302]
+    assert enriched["day_type"].astype(str).tolist() == ["Weekend", "Weekday"]
+
+
+def test_cleanse_sensor_location(pipeline):
+    header, rows = make_sensor_locations()
+    df = pd.DataFrame(rows, columns=header)
+    coordinates = [(-37.8095, 144.9615), (-37.8092, 144.9612), (10.0, 144.963), (-37.807, 144.963),
+                   (-37.8025, 144.9685)]
+    df["location"] = ["\n    ({}, {})".format(latitude, longitude) for latitude, longitude in coordinates]
+    df["latitude"], df["longitude"] = zip(*coordinates)
+    df.loc[1, ["latitude", "longitude"]] = float("nan")  # parsed from the location string
+    df.loc[3, "latitude"] = -37.9  # not consistent with the location string (the third one is out of Melbourne)
+
+    cleansed = pipeline.cleanse_sensor_location(df)
+    assert cleansed["location"].tolist()[:2] == ["(-37.8095, 144.9615)", "(-37.8092, 144.9612)"]
+    assert cleansed["latitude"].tolist()[:2] == [-37.8095, -37.8092]
+    assert cleansed["longitude"].tolist()[:2] == [144.9615, 144.9612]
+    assert cleansed["latitude"].isna().tolist() == [False, False, True, True, False]
+    assert cleansed["longitude"].isna().tolist() == [False, False, True, True, False]
+
+    # the first two sensors are in the same (~100 meters) cell, the last one is in another cell
+    cell_ids = cleansed["grid_cell_id"]
+    assert cell_ids.isna().tolist() == [False, False, True, True, False]
+    assert cell_ids[0] == cell_ids[1] == 52190 * 360000 + 324961
+    assert cell_ids[4] == 52197 * 360000 + 324968
+
+
+def test_compact_hourly_counts_leaves_its_input_unchanged(pipeline):
+    header, rows = make_hourly_counts(2)
+    df = pd.DataFrame(rows, columns=header)
+    original = df.copy()
+
+    compacted = pipeline.compact_hourly_counts_data(df)
+    pd.testing.assert_frame_equal(df, original)
+    assert compacted["date_time"].dtype.kind == "M"
+    assert compacted["hourly_counts"].dtype == "int16"
+    assert isinstance(compacted["day"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(compacted.astype(original.dtypes.to_dict()).drop(columns="date_time"),
+                                  original.drop(columns="date_time"))